@@ -1 +1,17 @@
-DATA_DIRECTORY = '/Users/emielzyde/python_personal/formula_1_analysis/data'
+import os
+
+DATA_DIRECTORY = os.environ.get(
+    'F1_DATA_DIRECTORY',
+    '/Users/emielzyde/python_personal/formula_1_analysis/data',
+)
+DERIVED_TABLES_CACHE_MAX_BYTES = int(
+    os.environ.get('F1_DERIVED_TABLES_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+)
+# If set, derived tables evicted from memory are written to this directory, so they can
+# be read back rather than rebuilt, also by other processes
+DERIVED_TABLES_SPILL_DIRECTORY = os.environ.get('F1_DERIVED_TABLES_SPILL_DIRECTORY')
+# The least recently used spilled tables are removed once the spill directory grows
+# beyond this size
+DERIVED_TABLES_SPILL_MAX_BYTES = int(
+    os.environ.get('F1_DERIVED_TABLES_SPILL_MAX_BYTES', 4 * 1024 * 1024 * 1024)
+)
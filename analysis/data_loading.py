@@ -1,5 +1,7 @@
-from functools import lru_cache
+import hashlib
+from functools import cached_property, lru_cache, wraps
 from pathlib import Path
+from typing import Callable
 
 import pandas as pd
 
@@ -18,43 +20,139 @@ RESULTS_DATA_FILE = 'results.csv'
 RACES_DATA_FILE = 'races.csv'
 SPRINT_RESULTS_DATA_FILE = 'sprint_results.csv'
 
-
-@lru_cache(maxsize=1)
+# With copy-on-write enabled, shallow copies share their column buffers with the
+# original frame and only copy a column when it is actually modified. This lets the
+# cached tables below be handed out to every caller (including concurrent Flask
+# threads) without defensive deep copies
+pd.set_option('mode.copy_on_write', True)
+
+
+def fingerprint_data(data: pd.DataFrame) -> str:
+    """
+    Calculates a fingerprint of the contents of a dataframe. Two dataframes have the
+    same fingerprint if they have the same columns, index and values
+
+    Parameters
+    ----------
+    data
+        The dataframe to fingerprint
+
+    Returns
+    -------
+    str
+        The fingerprint, as a hex string
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(','.join(map(str, data.columns)).encode())
+    hasher.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    return hasher.hexdigest()
+
+
+class _CachedTable:
+    """
+    A table held by the cache of a loader, together with its fingerprint. The
+    fingerprint is only calculated when it is first needed
+    """
+    def __init__(self, data: pd.DataFrame):
+        self.data = data
+
+    @cached_property
+    def fingerprint(self) -> str:
+        return fingerprint_data(self.data)
+
+
+def shared_table(loader: Callable[[], pd.DataFrame]) -> Callable[[], pd.DataFrame]:
+    """
+    Caches the table returned by a loader and hands out a shallow copy of it on every
+    call. The copies share their data with the cached table, so they are free to make,
+    but adding, replacing or modifying columns on a copy never affects the cached table
+    or any other caller's copy
+
+    Parameters
+    ----------
+    loader
+        The function that reads the table
+
+    Returns
+    -------
+    Callable[[], pd.DataFrame]
+        The caching loader. Its cache can be cleared with `cache_clear`, and the
+        fingerprint of the cached table is returned by `fingerprint`
+    """
+    @lru_cache(maxsize=1)
+    def load_cached_table() -> _CachedTable:
+        return _CachedTable(loader())
+
+    @wraps(loader)
+    def load_shared_table() -> pd.DataFrame:
+        return load_cached_table().data.copy(deep=False)
+
+    def fingerprint() -> str:
+        return load_cached_table().fingerprint
+
+    load_shared_table.fingerprint = fingerprint
+    load_shared_table.cache_clear = load_cached_table.cache_clear
+    return load_shared_table
+
+
+def get_data_version(*loaders: Callable[[], pd.DataFrame]) -> str:
+    """
+    Calculates a version of the data returned by the given loaders, which changes
+    whenever the contents of any of their tables change
+
+    Parameters
+    ----------
+    loaders
+        The loaders, which must have been decorated with `shared_table`
+
+    Returns
+    -------
+    str
+        The data version, as a hex string
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    for loader in loaders:
+        hasher.update(loader.__name__.encode())
+        hasher.update(loader.fingerprint().encode())
+    return hasher.hexdigest()
+
+
+@shared_table
 def load_drivers_data():
     return pd.read_csv(Path(DATA_DIRECTORY) / DRIVERS_DATA_FILE, encoding=ENCODING)
 
 
-@lru_cache(maxsize=1)
+@shared_table
 def load_results_data():
     return pd.read_csv(Path(DATA_DIRECTORY) / RESULTS_DATA_FILE, encoding=ENCODING)
 
 
-@lru_cache(maxsize=1)
+@shared_table
 def load_driver_standings_data():
     return pd.read_csv(Path(DATA_DIRECTORY) / DRIVER_STANDINGS_FILE, encoding=ENCODING)
 
 
-@lru_cache(maxsize=1)
+@shared_table
 def load_races_data():
     return pd.read_csv(Path(DATA_DIRECTORY) / RACES_DATA_FILE, encoding=ENCODING)
 
 
-@lru_cache(maxsize=1)
+@shared_table
 def load_qualifying_data():
     return pd.read_csv(Path(DATA_DIRECTORY) / QUALIFYING_DATA_FILE, encoding=ENCODING)
 
 
-@lru_cache(maxsize=1)
+@shared_table
 def load_circuits_data():
     return pd.read_csv(Path(DATA_DIRECTORY) / QUALIFYING_DATA_FILE, encoding=ENCODING)
 
 
-@lru_cache(maxsize=1)
+@shared_table
 def load_constructors_data():
     return pd.read_csv(Path(DATA_DIRECTORY) / CONSTRUCTORS_DATA_FILE, encoding=ENCODING)
 
 
-@lru_cache(maxsize=1)
+@shared_table
 def load_constructor_results_data():
     return pd.read_csv(
         Path(DATA_DIRECTORY) / CONSTRUCTOR_RESULTS_DATA_FILE,
@@ -62,7 +160,7 @@ def load_constructor_results_data():
     )
 
 
-@lru_cache(maxsize=1)
+@shared_table
 def load_constructor_standings_data():
     return pd.read_csv(
         Path(DATA_DIRECTORY) / CONSTRUCTOR_STANDINGS_DATA_FILE,
@@ -70,7 +168,7 @@ def load_constructor_standings_data():
     )
 
 
-@lru_cache(maxsize=1)
+@shared_table
 def load_sprint_results_data():
     return pd.read_csv(
         Path(DATA_DIRECTORY) / SPRINT_RESULTS_DATA_FILE,
@@ -78,6 +176,6 @@ def load_sprint_results_data():
     )
 
 
-@lru_cache(maxsize=1)
+@shared_table
 def load_lap_times():
     return pd.read_csv(Path(DATA_DIRECTORY) / LAP_TIMES_FILE, encoding=ENCODING)
@@ -0,0 +1,211 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from contextlib import suppress
+from functools import wraps
+from pathlib import Path
+from typing import Callable, Hashable, List, Optional, Tuple
+
+import pandas as pd
+
+from .constants import (
+    DERIVED_TABLES_CACHE_MAX_BYTES,
+    DERIVED_TABLES_SPILL_DIRECTORY,
+    DERIVED_TABLES_SPILL_MAX_BYTES,
+)
+
+SPILL_FILE_SUFFIX = '.pkl'
+
+
+class DerivedTablesCache:
+    """
+    A least-recently-used cache of dataframes, bounded by the memory the dataframes
+    use rather than by their number. If a spill directory is given, evicted dataframes
+    are written to it and read back on the next request for them. The spill directory
+    is bounded as well: after every spill, the least recently used files are removed
+    until the directory fits in its limit, which also clears out tables that are stale
+    because their sources changed
+
+    Parameters
+    ----------
+    max_bytes
+        The maximum memory (in bytes) used by the dataframes held in memory
+    spill_directory
+        The directory evicted dataframes are written to, if any
+    spill_max_bytes
+        The maximum size (in bytes) of the files in the spill directory
+    """
+    def __init__(
+        self,
+        max_bytes: int,
+        spill_directory: Optional[str] = None,
+        spill_max_bytes: int = DERIVED_TABLES_SPILL_MAX_BYTES,
+    ):
+        self.max_bytes = max_bytes
+        self.spill_directory = Path(spill_directory) if spill_directory else None
+        self.spill_max_bytes = spill_max_bytes
+        self._tables = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def _spill_path(self, key: str) -> Path:
+        return self.spill_directory / f'{key}{SPILL_FILE_SUFFIX}'
+
+    def _spill(self, key: str, data: pd.DataFrame):
+        path = self._spill_path(key)
+        if path.exists():
+            return
+        self.spill_directory.mkdir(parents=True, exist_ok=True)
+        temporary_path = path.with_name(f'{path.name}.{threading.get_ident()}.tmp')
+        data.to_pickle(temporary_path)
+        os.replace(temporary_path, path)
+
+    def _prune_spill_directory(self):
+        # The modification time of a spilled table is updated whenever it is read back,
+        # so the oldest files are the least recently used ones. Other processes may be
+        # spilling and pruning at the same time, so files can disappear at any point
+        spilled_files = []
+        for path in self.spill_directory.glob(f'*{SPILL_FILE_SUFFIX}'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            spilled_files.append((stat.st_mtime, stat.st_size, path))
+
+        total_bytes = sum(size for _, size, _ in spilled_files)
+        for _, size, path in sorted(spilled_files):
+            if total_bytes <= self.spill_max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total_bytes -= size
+
+    def _evict(self) -> List[Tuple[str, pd.DataFrame]]:
+        # Must be called with the lock held. The evicted tables are only returned, so
+        # that they can be spilled after the lock is released
+        evicted = []
+        while self._total_bytes > self.max_bytes and self._tables:
+            key, (data, size) = self._tables.popitem(last=False)
+            self._total_bytes -= size
+            evicted.append((key, data))
+        return evicted
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        """
+        Returns the dataframe stored under the key, or None if there is none
+        """
+        with self._lock:
+            if key in self._tables:
+                self._tables.move_to_end(key)
+                return self._tables[key][0]
+
+        if self.spill_directory is None:
+            return None
+        path = self._spill_path(key)
+        try:
+            data = pd.read_pickle(path)
+        except FileNotFoundError:
+            return None
+        # Marks the file as recently used, so that it is pruned last
+        with suppress(FileNotFoundError):
+            os.utime(path)
+        self.put(key, data)
+        return data
+
+    def put(self, key: str, data: pd.DataFrame):
+        """
+        Stores a dataframe under the key, evicting the least recently used dataframes
+        if the cache is full
+        """
+        size = int(data.memory_usage(index=True, deep=True).sum())
+        with self._lock:
+            if key in self._tables:
+                self._total_bytes -= self._tables.pop(key)[1]
+            self._tables[key] = (data, size)
+            self._total_bytes += size
+            evicted = self._evict()
+
+        # Writing to disk is slow, so it is done without holding the lock, which would
+        # block every other thread's lookups
+        if self.spill_directory is not None and evicted:
+            for evicted_key, evicted_data in evicted:
+                self._spill(evicted_key, evicted_data)
+            self._prune_spill_directory()
+
+    def clear(self):
+        """
+        Removes all dataframes from memory. Spilled dataframes are kept
+        """
+        with self._lock:
+            self._tables.clear()
+            self._total_bytes = 0
+
+
+derived_tables_cache = DerivedTablesCache(
+    max_bytes=DERIVED_TABLES_CACHE_MAX_BYTES,
+    spill_directory=DERIVED_TABLES_SPILL_DIRECTORY,
+    spill_max_bytes=DERIVED_TABLES_SPILL_MAX_BYTES,
+)
+
+
+def _make_key(
+    builder: Callable[..., pd.DataFrame],
+    version: int,
+    sources: tuple,
+    args: tuple,
+    kwargs: dict,
+) -> str:
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(f'{builder.__module__}.{builder.__qualname__}'.encode())
+    hasher.update(str(version).encode())
+    for source in sources:
+        hasher.update(source.__name__.encode())
+        hasher.update(source.fingerprint().encode())
+    hasher.update(repr((args, sorted(kwargs.items()))).encode())
+    return hasher.hexdigest()
+
+
+def memoize_derived(*sources: Callable[[], pd.DataFrame], version: int):
+    """
+    Memoizes a function that builds a table from the tables returned by the given
+    loaders. The tables are stored in `derived_tables_cache` under a key made up of the
+    arguments, the version and the fingerprints of the source tables, so a table is
+    only rebuilt when one of the tables it was built from changes, or the version is
+    bumped.
+
+    Spilled tables outlive the process and are shared with other processes, so the
+    version must be bumped whenever the way the table is built changes, including
+    changes to the helpers and constants the function uses. Otherwise, tables built by
+    the old code are read back.
+
+    As with the loaders, every call returns a shallow copy of the stored table, which
+    callers are free to modify.
+
+    Parameters
+    ----------
+    sources
+        The loaders of the tables the function reads. These must have been decorated
+        with `shared_table`, and the function must not read any other data
+    version
+        The version of the function
+
+    Returns
+    -------
+    The decorator. The sources and the version of the memoized function are recorded
+    as its `sources` and `version`
+    """
+    def decorator(builder: Callable[..., pd.DataFrame]):
+        @wraps(builder)
+        def memoized_builder(*args: Hashable, **kwargs: Hashable) -> pd.DataFrame:
+            key = _make_key(builder, version, sources, args, kwargs)
+            data = derived_tables_cache.get(key)
+            if data is None:
+                data = builder(*args, **kwargs)
+                derived_tables_cache.put(key, data)
+            return data.copy(deep=False)
+
+        memoized_builder.sources = sources
+        memoized_builder.version = version
+        return memoized_builder
+
+    return decorator
@@ -1,18 +1,42 @@
+from typing import Dict, Optional
+
+import numpy as np
 import pandas as pd
 
 from .data_loading import (
+    load_constructors_data,
     load_drivers_data,
     load_qualifying_data,
     load_races_data,
     load_results_data,
 )
+from .enums import StandingsDataType
+from .memoization import memoize_derived
+from constants import RACE_ID_STR
 
 DRIVER_COL = 'driver'
 DRIVER_ID_COL = 'driverId'
+CONSTRUCTOR_ID_COL = 'constructorId'
 CODE_COL = 'code'
 POSITION_COL = 'position'
+FINISH_POSITION_COL = 'positionOrder'
+QUALIFYING_POSITION_COL = 'qualifying_position'
+POSITIONS_GAINED_COL = 'positions_gained'
+CONVERTED_COL = 'converted'
+
+NUMBER_OF_BOOTSTRAP_RESAMPLES = 1000
+CONFIDENCE_LEVEL = 0.95
+# The maximum number of resampled row indices held in memory at once while
+# bootstrapping. Small batches keep the gathers in the CPU cache, which is faster
+# than fewer, larger batches
+BOOTSTRAP_BATCH_SIZE = 100_000
+GROUP_ID_COLS = {
+    StandingsDataType.drivers: DRIVER_ID_COL,
+    StandingsDataType.constructors: CONSTRUCTOR_ID_COL,
+}
 
 
+@memoize_derived(load_drivers_data, load_results_data, load_races_data, version=1)
 def process_data():
     """
     Loads the driver and results data and processed the data by:
@@ -44,11 +68,414 @@ def process_data():
     return data_with_race_dates.sort_values(by='date')
 
 
-def analyse_data(data: pd.DataFrame, qualifying_data: pd.DataFrame):
-    #average_position_data = data.groupby(CODE_COL)[POSITION_COL].notna().mean()
-    a=0
+def join_qualifying_and_results(
+    data: pd.DataFrame,
+    qualifying_data: pd.DataFrame,
+) -> pd.DataFrame:
+    """
+    Joins the qualifying data to the results data, so that each row is one driver in
+    one race, and adds:
+    1. The driver and constructor names
+    2. The number of positions gained from qualifying to the finish
+    3. Whether the driver converted their qualifying position, i.e. finished at or
+    ahead of it
+
+    Parameters
+    ----------
+    data
+        The results data, as returned by `process_data`
+    qualifying_data
+        The qualifying data
+
+    Returns
+    -------
+    pd.DataFrame
+        The joined data
+    """
+    constructors_data = load_constructors_data()
+
+    joined_data = pd.merge(
+        data,
+        qualifying_data[[RACE_ID_STR, DRIVER_ID_COL, POSITION_COL]].rename(
+            columns={POSITION_COL: QUALIFYING_POSITION_COL},
+        ),
+        on=[RACE_ID_STR, DRIVER_ID_COL],
+    )
+    joined_data = pd.merge(
+        joined_data,
+        constructors_data[[CONSTRUCTOR_ID_COL, 'name']].rename(
+            columns={'name': StandingsDataType.constructors.value},
+        ),
+        on=CONSTRUCTOR_ID_COL,
+    )
+
+    return joined_data.assign(**{
+        StandingsDataType.drivers.value: (
+            joined_data['forename'] + ' ' + joined_data['surname']
+        ),
+        POSITIONS_GAINED_COL: (
+            joined_data[QUALIFYING_POSITION_COL] - joined_data[FINISH_POSITION_COL]
+        ),
+        CONVERTED_COL: (
+            joined_data[FINISH_POSITION_COL] <= joined_data[QUALIFYING_POSITION_COL]
+        ),
+    })
+
+
+def _calculate_correlations_from_sums(
+    sum_x: np.ndarray,
+    sum_y: np.ndarray,
+    sum_xx: np.ndarray,
+    sum_yy: np.ndarray,
+    sum_xy: np.ndarray,
+    group_sizes: np.ndarray,
+) -> np.ndarray:
+    """
+    Calculates Pearson correlations from the sums of x, y and their products within
+    each group. Groups in which either variable is constant have a correlation of NaN
+    """
+    covariance = sum_xy - sum_x * sum_y / group_sizes
+    variance_x = sum_xx - sum_x ** 2 / group_sizes
+    variance_y = sum_yy - sum_y ** 2 / group_sizes
+
+    denominator = np.sqrt(np.clip(variance_x * variance_y, 0, None))
+    correlations = np.full(np.broadcast(covariance, denominator).shape, np.nan)
+    np.divide(covariance, denominator, out=correlations, where=denominator > 1e-9)
+    return correlations
+
+
+def _calculate_quantiles(values: np.ndarray, quantiles: np.ndarray) -> np.ndarray:
+    """
+    Calculates the quantiles of each column, ignoring NaNs, with the same linear
+    interpolation as `np.nanquantile`. This sorts all the columns at once, where
+    `np.nanquantile` loops over them
+    """
+    sorted_values = np.sort(values, axis=0)
+    counts = np.count_nonzero(~np.isnan(values), axis=0)
+    positions = np.multiply.outer(quantiles, np.maximum(counts - 1, 0))
+    lower_indices = np.floor(positions).astype(int)
+    upper_indices = np.minimum(lower_indices + 1, np.maximum(counts - 1, 0))
+    lower_values = np.take_along_axis(sorted_values, lower_indices, axis=0)
+    upper_values = np.take_along_axis(sorted_values, upper_indices, axis=0)
+    result = lower_values + (upper_values - lower_values) * (positions - lower_indices)
+    result[:, counts == 0] = np.nan
+    return result
+
+
+def _rank_within_groups(
+    row_bins: np.ndarray,
+    group_sizes: np.ndarray,
+    number_of_values: int,
+) -> np.ndarray:
+    """
+    Ranks the values of every sample (a row of `row_bins`) within their group, giving
+    tied values their average rank, as `pd.Series.rank` does. The ranks are returned
+    doubled, so that they are integers, and centred on their mean within the group.
+    Both leave the rank correlation unchanged, and the centred ranks of a group sum to
+    zero.
+
+    The positions in a race only take a few distinct values, so instead of sorting,
+    the values in each sample and group are counted with a single `np.bincount`. The
+    rank of a value is then the number of smaller values plus the average position
+    among its ties
+
+    Parameters
+    ----------
+    row_bins
+        For each sample and row, the group of the row times `number_of_values` plus a
+        code from 0 to `number_of_values - 1` that sorts like the value
+    group_sizes
+        The number of rows in each group
+    number_of_values
+        The number of distinct values
+
+    Returns
+    -------
+    np.ndarray
+        The doubled, centred ranks, as integers with the same shape as `row_bins`
+    """
+    number_of_samples = row_bins.shape[0]
+    table_size = len(group_sizes) * number_of_values
+    bins = row_bins + np.arange(
+        0,
+        number_of_samples * table_size,
+        table_size,
+        dtype=row_bins.dtype,
+    )[:, None]
+    counts = np.bincount(
+        bins.ravel(),
+        minlength=number_of_samples * table_size,
+    ).reshape(number_of_samples, len(group_sizes), number_of_values)
+    # Twice the number of smaller values, plus the number of ties and one, less twice
+    # the mean rank of the group, i.e. the group size plus one
+    centred_ranks = np.cumsum(counts, axis=2)
+    centred_ranks *= 2
+    centred_ranks -= counts
+    centred_ranks -= group_sizes[:, None]
+    return np.take(centred_ranks.ravel(), bins)
+
+
+def _draw_resampled_indices(
+    group_starts: np.ndarray,
+    group_sizes: np.ndarray,
+    number_of_resamples: int,
+    random_state: np.random.Generator,
+) -> np.ndarray:
+    """
+    Draws the rows of bootstrap resamples of data sorted by group. In every resample,
+    each row is replaced by a row drawn at random from the same group
+
+    Returns
+    -------
+    np.ndarray
+        The indices of the drawn rows, with shape (number of resamples, number of rows)
+    """
+    row_group_starts = np.repeat(group_starts, group_sizes).astype(np.int32)
+    row_group_sizes = np.repeat(group_sizes, group_sizes).astype(np.float32)
+    # Single precision halves the memory traffic of drawing the random numbers. The
+    # largest single-precision number below one, times any group size below 2 ** 24,
+    # rounds to below the group size, so the drawn rows never leave their group
+    resampled_indices = (
+        random_state.random(
+            (number_of_resamples, len(row_group_starts)),
+            dtype=np.float32,
+        )
+        * row_group_sizes
+    ).astype(np.int32)
+    resampled_indices += row_group_starts
+    return resampled_indices
+
+
+def _bootstrap_group_statistics(
+    positions_gained: np.ndarray,
+    converted: np.ndarray,
+    qualifying_positions: np.ndarray,
+    finish_positions: np.ndarray,
+    group_starts: np.ndarray,
+    group_sizes: np.ndarray,
+    number_of_resamples: int,
+    confidence_level: float,
+    random_state: np.random.Generator,
+) -> Dict[str, np.ndarray]:
+    """
+    Calculates bootstrap confidence intervals of the mean positions gained, the
+    conversion rate and the rank correlation in each group. The rows must be sorted by
+    group. Resamples in which every drawn qualifying or finishing position is the same
+    have no rank correlation, and are left out of its interval.
+
+    Every resample draws, for each row, a row at random from the same group. The
+    resamples are drawn as one matrix of row indices (in batches, to bound the memory
+    used) and the per-group sums are taken with `np.add.reduceat`, so there is no loop
+    over the groups. For the rank correlation, the drawn positions are ranked again
+    within each resample (see `_rank_within_groups`)
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        The lower and upper bounds of each statistic, with shape (2, number of groups)
+    """
+    number_of_rows = len(positions_gained)
+    number_of_groups = len(group_sizes)
+    row_group_codes = np.repeat(np.arange(number_of_groups), group_sizes)
+    batch_size = max(1, BOOTSTRAP_BATCH_SIZE // number_of_rows)
+    # Every statistic is calculated from whole numbers per row: the positions gained,
+    # whether the race was converted and, for ranking the positions, their bins (see
+    # `_rank_within_groups`). These are stacked into one matrix, so that each batch
+    # takes a single gather
+    rank_bins = []
+    number_of_position_values = []
+    for positions in (qualifying_positions, finish_positions):
+        unique_positions, codes = np.unique(positions, return_inverse=True)
+        rank_bins.append(row_group_codes * len(unique_positions) + codes)
+        number_of_position_values.append(len(unique_positions))
+    row_values = np.column_stack([
+        positions_gained,
+        converted,
+        *rank_bins,
+    ]).astype(np.int32)
+
+    resampled_statistics = {
+        statistic: np.empty((number_of_resamples, number_of_groups))
+        for statistic in ('positions_gained', 'conversion_rate', 'rank_correlation')
+    }
+    for batch_start in range(0, number_of_resamples, batch_size):
+        batch = slice(batch_start, min(batch_start + batch_size, number_of_resamples))
+        resampled_indices = _draw_resampled_indices(
+            group_starts,
+            group_sizes,
+            batch.stop - batch.start,
+            random_state,
+        )
+        resampled_rows = np.moveaxis(
+            np.take(row_values, resampled_indices, axis=0),
+            -1,
+            0,
+        )
+        resampled_statistics['positions_gained'][batch] = (
+            np.add.reduceat(resampled_rows[0], group_starts, axis=1) / group_sizes
+        )
+        resampled_statistics['conversion_rate'][batch] = (
+            np.add.reduceat(resampled_rows[1], group_starts, axis=1) / group_sizes
+        )
+        qualifying_ranks, finish_ranks = (
+            _rank_within_groups(resampled_bins, group_sizes, number_of_values)
+            for resampled_bins, number_of_values in zip(
+                resampled_rows[2:],
+                number_of_position_values,
+            )
+        )
+        # The centred ranks of every group sum to zero
+        resampled_statistics['rank_correlation'][batch] = (
+            _calculate_correlations_from_sums(
+                0,
+                0,
+                np.add.reduceat(qualifying_ranks ** 2, group_starts, axis=1),
+                np.add.reduceat(finish_ranks ** 2, group_starts, axis=1),
+                np.add.reduceat(qualifying_ranks * finish_ranks, group_starts, axis=1),
+                group_sizes,
+            )
+        )
+
+    tail_probability = (1 - confidence_level) / 2
+    return {
+        statistic: _calculate_quantiles(
+            resampled_values,
+            np.array([tail_probability, 1 - tail_probability]),
+        )
+        for statistic, resampled_values in resampled_statistics.items()
+    }
+
+
+def calculate_qualifying_vs_race_statistics(
+    joined_data: pd.DataFrame,
+    standings_data_type: StandingsDataType,
+    number_of_resamples: int = NUMBER_OF_BOOTSTRAP_RESAMPLES,
+    confidence_level: float = CONFIDENCE_LEVEL,
+    seed: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Calculates, per driver or per constructor and across all seasons:
+    1. The mean number of positions gained from qualifying to the finish
+    2. The conversion rate, i.e. the fraction of races finished at or ahead of the
+    qualifying position
+    3. The Spearman rank correlation between the qualifying and finishing positions
+
+    Each comes with a bootstrap confidence interval. Drivers and constructors are
+    told apart by their ids, so two with the same name get a row each.
+
+    Parameters
+    ----------
+    joined_data
+        The joined qualifying and results data, as returned by
+        `join_qualifying_and_results`
+    standings_data_type
+        Whether to calculate the statistics per driver or per constructor
+    number_of_resamples
+        The number of bootstrap resamples
+    confidence_level
+        The confidence level of the intervals
+    seed
+        The seed for the bootstrap resampling
+
+    Returns
+    -------
+    pd.DataFrame
+        The statistics, with one row per driver or constructor
+    """
+    id_col = GROUP_ID_COLS[standings_data_type]
+    name_col = standings_data_type.value
+    joined_data = (
+        joined_data
+        .dropna(subset=[id_col, QUALIFYING_POSITION_COL, FINISH_POSITION_COL])
+        .sort_values(by=id_col, kind='stable')
+    )
+    group_codes, group_ids = pd.factorize(joined_data[id_col], sort=True)
+    group_sizes = np.bincount(group_codes)
+    group_starts = np.concatenate([[0], np.cumsum(group_sizes)[:-1]])
+
+    positions_gained = joined_data[POSITIONS_GAINED_COL].to_numpy(dtype=float)
+    converted = joined_data[CONVERTED_COL].to_numpy(dtype=float)
+    # The Spearman correlation is the Pearson correlation of the ranks
+    grouped_data = joined_data.groupby(id_col, sort=True)
+    group_names = grouped_data[name_col].first()
+    qualifying_ranks = grouped_data[QUALIFYING_POSITION_COL].rank().to_numpy()
+    finish_ranks = grouped_data[FINISH_POSITION_COL].rank().to_numpy()
+
+    def sum_per_group(values: np.ndarray) -> np.ndarray:
+        return np.bincount(group_codes, weights=values)
+
+    bounds = _bootstrap_group_statistics(
+        positions_gained,
+        converted,
+        joined_data[QUALIFYING_POSITION_COL].to_numpy(),
+        joined_data[FINISH_POSITION_COL].to_numpy(),
+        group_starts=group_starts,
+        group_sizes=group_sizes,
+        number_of_resamples=number_of_resamples,
+        confidence_level=confidence_level,
+        random_state=np.random.default_rng(seed),
+    )
+
+    return pd.DataFrame({
+        id_col: group_ids,
+        name_col: group_names.reindex(group_ids).to_numpy(),
+        'races': group_sizes,
+        'mean_positions_gained': sum_per_group(positions_gained) / group_sizes,
+        'mean_positions_gained_lower': bounds['positions_gained'][0],
+        'mean_positions_gained_upper': bounds['positions_gained'][1],
+        'conversion_rate': sum_per_group(converted) / group_sizes,
+        'conversion_rate_lower': bounds['conversion_rate'][0],
+        'conversion_rate_upper': bounds['conversion_rate'][1],
+        'rank_correlation': _calculate_correlations_from_sums(
+            sum_per_group(qualifying_ranks),
+            sum_per_group(finish_ranks),
+            sum_per_group(qualifying_ranks * qualifying_ranks),
+            sum_per_group(finish_ranks * finish_ranks),
+            sum_per_group(qualifying_ranks * finish_ranks),
+            group_sizes,
+        ),
+        'rank_correlation_lower': bounds['rank_correlation'][0],
+        'rank_correlation_upper': bounds['rank_correlation'][1],
+    }).sort_values(by='mean_positions_gained', ascending=False)
+
+
+def analyse_data(
+    data: pd.DataFrame,
+    qualifying_data: pd.DataFrame,
+    seed: Optional[int] = None,
+) -> Dict[StandingsDataType, pd.DataFrame]:
+    """
+    Compares the qualifying and race performance of every driver and every constructor
+    (see `calculate_qualifying_vs_race_statistics`)
+
+    Parameters
+    ----------
+    data
+        The results data, as returned by `process_data`
+    qualifying_data
+        The qualifying data
+    seed
+        The seed for the bootstrap resampling
+
+    Returns
+    -------
+    Dict[StandingsDataType, pd.DataFrame]
+        The statistics per driver and per constructor
+    """
+    joined_data = join_qualifying_and_results(data, qualifying_data)
+    return {
+        standings_data_type: calculate_qualifying_vs_race_statistics(
+            joined_data,
+            standings_data_type=standings_data_type,
+            seed=seed,
+        )
+        for standings_data_type in StandingsDataType
+    }
 
 
 if __name__ == '__main__':
     data = process_data()
-    analyse_data(data, load_qualifying_data())
\ No newline at end of file
+    statistics = analyse_data(data, load_qualifying_data())
+    for standings_data_type, statistics_for_type in statistics.items():
+        print(f'Qualifying vs race performance per {standings_data_type.name[:-1]}')
+        print(statistics_for_type.head(20).to_string(index=False))
@@ -13,6 +13,7 @@ from .data_loading import (
     load_sprint_results_data,
 )
 from .enums import StandingsDataType
+from .memoization import memoize_derived
 from constants import DRIVER_ID_STR, RACE_ID_STR
 
 EMPTY_SYMBOL = '\\N'
@@ -81,6 +82,12 @@ def _merge_races_constructors_and_standings_data(
     ).rename(columns={'name': 'race_name'})
 
 
+@memoize_derived(
+    load_constructor_standings_data,
+    load_constructors_data,
+    load_races_data,
+    version=1,
+)
 def construct_constructor_standings_data() -> pd.DataFrame:
     """
     Constructs the constructor standings data. First merges the standings data with the
@@ -101,6 +108,13 @@ def construct_constructor_standings_data() -> pd.DataFrame:
     return merged_data
 
 
+@memoize_derived(
+    load_driver_standings_data,
+    load_drivers_data,
+    load_constructors_data,
+    load_races_data,
+    version=1,
+)
 def construct_driver_standings_data() -> pd.DataFrame:
     """
     Constructs the driver standings data. First merges the standings data with the races
@@ -154,8 +168,11 @@ def plot_standings_data_over_time(
     standings_data_type
         The type of standings data that should be plotted
     """
-    standings_data['date'] = pd.to_datetime(standings_data['date'])
-    standings_data = standings_data.sort_values(by='date')
+    standings_data = (
+        standings_data
+        .assign(date=pd.to_datetime(standings_data['date']))
+        .sort_values(by='date')
+    )
     standings_for_year_data = standings_data[standings_data['year'] == year]
 
     fig = go.Figure()
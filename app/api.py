@@ -1,20 +1,39 @@
-import os
+import gzip
+import threading
 
 import flask
-import plotly.offline as pyo
 from flask import Markup
 from flask_socketio import SocketIO
-from langchain.chat_models import ChatOpenAI
-from langchain_experimental.agents import create_pandas_dataframe_agent
+from flask_wtf.csrf import validate_csrf
+from wtforms.validators import ValidationError
 
-from analysis.preliminary_analysis import construct_driver_standings_data
 from simulation.enums import RaceName
-from simulation.run import run_simulation
+from simulation.prerender import get_prerendered_simulation_path
+from simulation.replay import (
+    IDENTITY_ENCODING,
+    build_race_replay_payload,
+    get_race_replay_version,
+    has_race_replay,
+    supported_encodings,
+)
+from simulation.run import render_simulation_div, run_simulation
+from .chatbot import (
+    AgentRunCancelledError,
+    ChatbotBusyError,
+    StreamingCallbackHandler,
+    run_chatbot_query,
+)
 from .forms import ChatBotForm, ModeSelectionForm, SimulationSelectionForm
 
 app = flask.Flask(__name__)
 socketio = SocketIO(app)
 
+RACE_REPLAY_MAX_AGE = 3600
+
+# The cancellation events of the chatbot queries in flight, keyed by socket session id
+_chatbot_runs = {}
+_chatbot_runs_lock = threading.Lock()
+
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
@@ -34,25 +53,32 @@ def index():
 @app.route('/simulation', methods=['GET', 'POST'])
 def simulation():
     """
-    The starting page for the simulation part of the app
+    The starting page for the simulation part of the app. Simulations that were
+    pre-rendered with `python -m simulation.prerender` are loaded by the page from
+    `simulation_figure`, the others are run and embedded in the page
     """
     form = SimulationSelectionForm()
     if form.validate_on_submit():
         if form.race.data and form.year.data:
-            figure = run_simulation(
-                race=RaceName(form.race.data),
-                reference_season=int(form.year.data),
-            )
-            output = pyo.offline.plot(
-                figure,
-                include_plotlyjs=False,
-                output_type='div',
-                auto_play=False,
-            )
+            race = RaceName(form.race.data)
+            reference_season = int(form.year.data)
+            if get_prerendered_simulation_path(race, reference_season) is not None:
+                return flask.render_template(
+                    'simulation_home_page.html',
+                    form=form,
+                    fig="",
+                    figure_url=flask.url_for(
+                        'simulation_figure',
+                        season=reference_season,
+                        race=race.name,
+                    ),
+                )
+
+            figure = run_simulation(race=race, reference_season=reference_season)
             return flask.render_template(
                 'simulation_home_page.html',
                 form=form,
-                fig=Markup(output),
+                fig=Markup(render_simulation_div(figure)),
             )
 
     return flask.render_template(
@@ -62,31 +88,189 @@ def simulation():
     )
 
 
+@app.route('/simulation/figure/<int:season>/<race>')
+def simulation_figure(season: int, race: str):
+    """
+    Returns the Plotly JSON of a pre-rendered simulation. The gzipped artifact is sent
+    as is to clients that accept gzip, and only decompressed for the others
+    """
+    race_name = RaceName.__members__.get(race)
+    if race_name is None:
+        flask.abort(404)
+    path = get_prerendered_simulation_path(race_name, season)
+    if path is None:
+        flask.abort(404)
+
+    if flask.request.accept_encodings['gzip']:
+        response = flask.send_file(path, mimetype='application/json')
+        response.content_encoding = 'gzip'
+    else:
+        response = flask.Response(
+            gzip.decompress(path.read_bytes()),
+            mimetype='application/json',
+        )
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+@app.route('/api/race/<int:season>/<race>')
+def race_replay(season: int, race: str):
+    """
+    Returns the lap by driver position and gap matrices of a race as a NumPy `.npz`
+    archive (see `simulation.replay.build_race_replay_payload`). The race can be given
+    by its name (e.g. `australia`) or its full name. The response carries a strong
+    ETag derived from the data version, so unchanged replays are revalidated with a
+    304 response without being rebuilt
+    """
+    race_name = RaceName.__members__.get(race)
+    if race_name is None:
+        try:
+            race_name = RaceName(race)
+        except ValueError:
+            flask.abort(404)
+    # Checked before the ETag, which could otherwise match for a race without data
+    if not has_race_replay(race_name, season):
+        flask.abort(404)
+
+    encoding = (
+        flask.request.accept_encodings.best_match(supported_encodings())
+        or IDENTITY_ENCODING
+    )
+    # Strong ETags have to differ between encodings of the same replay
+    etag = f'{get_race_replay_version(race_name, season)}-{encoding}'
+    if flask.request.if_none_match.contains(etag):
+        response = flask.Response(status=304)
+    else:
+        payload = build_race_replay_payload(race_name, season, encoding=encoding)
+        if payload is None:
+            flask.abort(404)
+        response = flask.Response(payload, mimetype='application/octet-stream')
+        if encoding != IDENTITY_ENCODING:
+            response.content_encoding = encoding
+
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = RACE_REPLAY_MAX_AGE
+    response.vary.add('Accept-Encoding')
+    return response
+
+
 @app.route('/chatbot', methods=['GET', 'POST'])
 def chatbot():
     """
-    The starting page for the chatbot part of the app
+    The starting page for the chatbot part of the app. The page streams the answer
+    over the socket (see `chatbot_query`) and only falls back to posting the form when
+    the socket is unavailable
     """
     form = ChatBotForm()
     if form.validate_on_submit():
         if form.api_key and form.query:
-            os.environ["OPENAI_API_KEY"] = form.api_key.data
-            standings_data = construct_driver_standings_data()
-            chatbot_agent = ChatOpenAI(model="gpt-3.5-turbo", temperature=0)
-            agent = create_pandas_dataframe_agent(
-                chatbot_agent,
-                standings_data,
-                verbose=True,
-            )
-            query_output = agent.run(form.query.data)
+            try:
+                query_output = run_chatbot_query(
+                    api_key=form.api_key.data,
+                    query=form.query.data,
+                )
+            except ChatbotBusyError as error:
+                query_output = str(error)
+            else:
+                query_output = f'The answer is: {query_output}'
 
             return flask.render_template(
                 'chat_bot_home_page.html',
                 form=form,
-                query_output=f'The answer is: {query_output}'
+                query_output=query_output,
             )
 
     return flask.render_template(
         'chat_bot_home_page.html',
         form=form,
     )
+
+
+def _stream_chatbot_query(
+    sid: str,
+    api_key: str,
+    query: str,
+    cancel_event: threading.Event,
+):
+    """
+    Runs a chatbot query in the background, emitting the agent's steps and the LLM's
+    tokens to the socket session that sent the query
+    """
+    def emit(event: str, data: dict):
+        socketio.emit(event, data, to=sid)
+
+    try:
+        answer = run_chatbot_query(
+            api_key=api_key,
+            query=query,
+            callbacks=[StreamingCallbackHandler(emit, cancel_event)],
+            cancel_event=cancel_event,
+        )
+    except AgentRunCancelledError:
+        emit('chatbot_cancelled', {})
+    except ChatbotBusyError as error:
+        emit('chatbot_error', {'message': str(error)})
+    except Exception as error:
+        emit('chatbot_error', {'message': f'The query failed: {error}'})
+    else:
+        emit('chatbot_answer', {'answer': f'The answer is: {answer}'})
+    finally:
+        with _chatbot_runs_lock:
+            _chatbot_runs.pop(sid, None)
+
+
+@socketio.on('chatbot_query')
+def chatbot_query(data: dict):
+    """
+    Starts answering a chatbot query sent over the socket. Each socket session can only
+    have one query in flight
+    """
+    sid = flask.request.sid
+    try:
+        validate_csrf(data.get('csrf_token'))
+    except ValidationError:
+        socketio.emit('chatbot_error', {'message': 'The form has expired'}, to=sid)
+        return
+    if not data.get('api_key') or not data.get('query'):
+        socketio.emit(
+            'chatbot_error',
+            {'message': 'Both an API key and a query are required'},
+            to=sid,
+        )
+        return
+
+    cancel_event = threading.Event()
+    with _chatbot_runs_lock:
+        if sid in _chatbot_runs:
+            socketio.emit(
+                'chatbot_error',
+                {'message': 'A query is already being answered'},
+                to=sid,
+            )
+            return
+        _chatbot_runs[sid] = cancel_event
+
+    socketio.start_background_task(
+        _stream_chatbot_query,
+        sid,
+        data['api_key'],
+        data['query'],
+        cancel_event,
+    )
+
+
+@socketio.on('chatbot_cancel')
+def chatbot_cancel():
+    """
+    Cancels the chatbot query in flight for the socket session, if there is one
+    """
+    with _chatbot_runs_lock:
+        cancel_event = _chatbot_runs.get(flask.request.sid)
+    if cancel_event is not None:
+        cancel_event.set()
+
+
+@socketio.on('disconnect')
+def disconnect():
+    chatbot_cancel()
@@ -0,0 +1,180 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.chat_models import ChatOpenAI
+from langchain.schema import AgentAction
+from langchain_experimental.agents import create_pandas_dataframe_agent
+
+from analysis.preliminary_analysis import construct_driver_standings_data
+
+CHATBOT_MODEL = 'gpt-3.5-turbo'
+MAX_CONCURRENT_AGENT_RUNS = int(os.environ.get('F1_MAX_CONCURRENT_AGENT_RUNS', 4))
+AGENT_RUN_QUEUE_TIMEOUT = 30
+# How often a query waiting for a slot checks whether it has been cancelled
+AGENT_RUN_QUEUE_POLL_INTERVAL = 0.1
+
+_agent_run_slots = threading.BoundedSemaphore(MAX_CONCURRENT_AGENT_RUNS)
+
+
+class ChatbotBusyError(Exception):
+    """
+    Raised when no agent run slot became free within the queue timeout
+    """
+
+
+class AgentRunCancelledError(Exception):
+    """
+    Raised from within an agent run to stop it once it has been cancelled
+    """
+
+
+@contextmanager
+def agent_run_slot(
+    cancel_event: Optional[threading.Event] = None,
+    timeout: float = AGENT_RUN_QUEUE_TIMEOUT,
+):
+    """
+    Limits the number of agent runs that are in flight at the same time. Waits for a
+    free slot for at most `timeout` seconds, giving up the place in the queue as soon
+    as the run is cancelled
+
+    Parameters
+    ----------
+    cancel_event
+        The event that is set when the run is cancelled
+    timeout
+        The maximum time (in seconds) to wait for a free slot
+
+    Raises
+    ------
+    ChatbotBusyError
+        If no slot became free in time
+    AgentRunCancelledError
+        If the run was cancelled while waiting for a slot
+    """
+    cancel_event = cancel_event or threading.Event()
+    deadline = time.monotonic() + timeout
+    while not _agent_run_slots.acquire(timeout=AGENT_RUN_QUEUE_POLL_INTERVAL):
+        if cancel_event.is_set():
+            raise AgentRunCancelledError('The query was cancelled')
+        if time.monotonic() >= deadline:
+            raise ChatbotBusyError(
+                'The chatbot is answering too many queries, please try again later'
+            )
+    try:
+        if cancel_event.is_set():
+            raise AgentRunCancelledError('The query was cancelled')
+        yield
+    finally:
+        _agent_run_slots.release()
+
+
+class StreamingCallbackHandler(BaseCallbackHandler):
+    """
+    Forwards the tokens generated by the LLM and the steps taken by the agent as they
+    happen, and stops the run as soon as it is cancelled
+    """
+    # Without this, langchain logs and ignores the exception raised on cancellation
+    raise_error = True
+
+    def __init__(
+        self,
+        emit: Callable[[str, Dict], None],
+        cancel_event: Optional[threading.Event] = None,
+    ):
+        self.emit = emit
+        self.cancel_event = cancel_event or threading.Event()
+
+    def _raise_if_cancelled(self):
+        if self.cancel_event.is_set():
+            raise AgentRunCancelledError('The query was cancelled')
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs):
+        self._raise_if_cancelled()
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages, **kwargs):
+        self._raise_if_cancelled()
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        self._raise_if_cancelled()
+        self.emit('chatbot_token', {'token': token})
+
+    def on_agent_action(self, action: AgentAction, **kwargs):
+        self._raise_if_cancelled()
+        self.emit(
+            'chatbot_step',
+            {'tool': action.tool, 'tool_input': str(action.tool_input)},
+        )
+
+    def on_tool_end(self, output: str, **kwargs):
+        self._raise_if_cancelled()
+        self.emit('chatbot_step', {'observation': str(output)})
+
+
+def create_chatbot_agent(api_key: str):
+    """
+    Creates the agent that answers queries about the driver standings data. The LLM
+    streams its tokens, so that they are passed to the callbacks of each run
+
+    Parameters
+    ----------
+    api_key
+        The OpenAI API key of the user
+
+    Returns
+    -------
+    The agent
+    """
+    chat_model = ChatOpenAI(
+        model=CHATBOT_MODEL,
+        temperature=0,
+        streaming=True,
+        openai_api_key=api_key,
+    )
+    return create_pandas_dataframe_agent(
+        chat_model,
+        construct_driver_standings_data(),
+        verbose=True,
+    )
+
+
+def run_chatbot_query(
+    api_key: str,
+    query: str,
+    callbacks: Optional[List[BaseCallbackHandler]] = None,
+    cancel_event: Optional[threading.Event] = None,
+) -> str:
+    """
+    Answers a query about the driver standings data, waiting for a free agent run slot
+    first. A run that is cancelled while waiting never starts
+
+    Parameters
+    ----------
+    api_key
+        The OpenAI API key of the user
+    query
+        The query to answer
+    callbacks
+        The callbacks to pass the run's tokens and steps to
+    cancel_event
+        The event that is set when the run is cancelled
+
+    Returns
+    -------
+    str
+        The answer to the query
+
+    Raises
+    ------
+    ChatbotBusyError
+        If no agent run slot became free in time
+    AgentRunCancelledError
+        If the run was cancelled before it started
+    """
+    with agent_run_slot(cancel_event=cancel_event):
+        agent = create_chatbot_agent(api_key)
+        return agent.run(query, callbacks=callbacks)
@@ -2,6 +2,7 @@ from flask_wtf import FlaskForm
 from wtforms import SelectField, StringField, SubmitField
 from wtforms.validators import DataRequired
 
+from simulation.constants import SIMULATION_SEASONS
 from simulation.enums import RaceName
 
 
@@ -17,8 +18,7 @@ class SimulationSelectionForm(FlaskForm):
     race_choices = [tuple([race, race]) for race in races]
     race = SelectField('Race', choices=race_choices)
 
-    years = list(range(1994, 2023))
-    year_choices = [tuple([year, year]) for year in years]
+    year_choices = [tuple([year, year]) for year in SIMULATION_SEASONS]
     year = SelectField('Year', choices=year_choices)
 
     submit = SubmitField('Submit selection!')
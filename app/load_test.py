@@ -0,0 +1,540 @@
+"""
+A load-testing harness for the app. It starts the app against synthetic data, with the
+OpenAI model replaced by a local fake, and drives a number of concurrent clients that
+submit the simulation and chatbot forms or stream chatbot answers over the socket.
+Nothing is sent over the network other than to the local server.
+
+Run it with
+
+    python -m app.load_test --clients 8 --duration 30
+
+The throughput, latency percentiles and error rates are reported per route. The
+command exits with a non-zero status if any of the given thresholds are exceeded, so
+it can be used to catch capacity regressions before a deploy.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from langchain.schema import AgentAction
+
+CSRF_TOKEN_PATTERN = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+SYNTHETIC_SEASONS = list(range(2018, 2023))
+SYNTHETIC_NUMBER_OF_DRIVERS = 20
+SYNTHETIC_NUMBER_OF_LAPS = 58
+SYNTHETIC_NUMBER_OF_RETIREMENTS = 3
+# The races of this season have no retirements, so every lap has the same cars
+SYNTHETIC_SEASON_WITHOUT_RETIREMENTS = SYNTHETIC_SEASONS[0]
+SYNTHETIC_NUMBER_OF_CONSTRUCTORS = 10
+FAKE_ANSWER_PREFIX = 'The standings data has'
+FAKE_TOOL = 'python_repl_ast'
+
+
+class FakeChatModel:
+    """
+    Stands in for `ChatOpenAI`, so that no API key or network access is needed
+    """
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+
+class FakeDataFrameAgent:
+    """
+    Stands in for the pandas dataframe agent. It answers every query with the size of
+    the data. Like the real agent, it first reports a tool step to the callbacks, then
+    emits the answer one token at a time over a fixed time, to mimic a streaming LLM
+    """
+    def __init__(self, data: pd.DataFrame, latency: float):
+        self.data = data
+        self.latency = latency
+
+    def run(self, query: str, callbacks: List = None, **kwargs) -> str:
+        callbacks = callbacks or []
+        answer = f'{FAKE_ANSWER_PREFIX} {len(self.data)} rows'
+        tokens = [f'{word} ' for word in answer.split(' ')]
+
+        for callback in callbacks:
+            callback.on_llm_start({}, [query])
+        for callback in callbacks:
+            callback.on_agent_action(
+                AgentAction(tool=FAKE_TOOL, tool_input='len(df)', log=''),
+            )
+        for callback in callbacks:
+            callback.on_tool_end(str(len(self.data)))
+        for token in tokens:
+            time.sleep(self.latency / len(tokens))
+            for callback in callbacks:
+                callback.on_llm_new_token(token)
+        return answer
+
+
+def write_synthetic_data(data_directory: Path, seed: int = 0):
+    """
+    Writes a small, self-consistent version of the datasets needed by the simulation
+    and chatbot pages. Some drivers retire from most races, but the races of one season
+    have no retirements, so both shapes of lap times data are exercised
+
+    Parameters
+    ----------
+    data_directory
+        The directory the CSV files are written to
+    seed
+        The seed for the random lap times and points
+    """
+    from analysis.data_loading import (
+        CONSTRUCTORS_DATA_FILE,
+        DRIVERS_DATA_FILE,
+        DRIVER_STANDINGS_FILE,
+        LAP_TIMES_FILE,
+        RACES_DATA_FILE,
+    )
+    from simulation.enums import RaceName
+
+    random_state = np.random.default_rng(seed)
+    driver_ids = np.arange(1, SYNTHETIC_NUMBER_OF_DRIVERS + 1)
+
+    pd.DataFrame({
+        'driverId': driver_ids,
+        'driverRef': [f'driver_{driver_id}' for driver_id in driver_ids],
+        'code': [f'D{driver_id:02d}' for driver_id in driver_ids],
+        'forename': [f'Driver{driver_id}' for driver_id in driver_ids],
+        'surname': [f'Surname{driver_id}' for driver_id in driver_ids],
+    }).to_csv(data_directory / DRIVERS_DATA_FILE, index=False)
+
+    constructor_ids = np.arange(1, SYNTHETIC_NUMBER_OF_CONSTRUCTORS + 1)
+    pd.DataFrame({
+        'constructorId': constructor_ids,
+        'name': [f'Constructor{constructor_id}' for constructor_id in constructor_ids],
+    }).to_csv(data_directory / CONSTRUCTORS_DATA_FILE, index=False)
+
+    races = []
+    for season in SYNTHETIC_SEASONS:
+        for round_number, race in enumerate(RaceName, start=1):
+            races.append({
+                'raceId': len(races) + 1,
+                'year': season,
+                'round': round_number,
+                'name': race.value,
+                'date': f'{season}-{3 + round_number:02d}-01',
+            })
+    races_data = pd.DataFrame(races)
+    races_data.to_csv(data_directory / RACES_DATA_FILE, index=False)
+
+    lap_times = []
+    driver_standings = []
+    points_per_driver = np.zeros(SYNTHETIC_NUMBER_OF_DRIVERS)
+    for race_id, season in zip(races_data['raceId'], races_data['year']):
+        milliseconds = random_state.normal(
+            loc=90_000,
+            scale=1_000,
+            size=(SYNTHETIC_NUMBER_OF_LAPS, SYNTHETIC_NUMBER_OF_DRIVERS),
+        ).astype(int)
+        cumulative_times = milliseconds.cumsum(axis=0)
+        number_of_retirements = (
+            0 if season == SYNTHETIC_SEASON_WITHOUT_RETIREMENTS
+            else SYNTHETIC_NUMBER_OF_RETIREMENTS
+        )
+        last_laps = np.full(SYNTHETIC_NUMBER_OF_DRIVERS, SYNTHETIC_NUMBER_OF_LAPS)
+        retired_drivers = random_state.choice(
+            SYNTHETIC_NUMBER_OF_DRIVERS,
+            size=number_of_retirements,
+            replace=False,
+        )
+        last_laps[retired_drivers] = random_state.integers(
+            1,
+            SYNTHETIC_NUMBER_OF_LAPS,
+            size=number_of_retirements,
+        )
+        for lap in range(SYNTHETIC_NUMBER_OF_LAPS):
+            is_running = last_laps > lap
+            lap_times.append(pd.DataFrame({
+                'raceId': race_id,
+                'driverId': driver_ids[is_running],
+                'lap': lap + 1,
+                'position': cumulative_times[lap, is_running].argsort().argsort() + 1,
+                'milliseconds': milliseconds[lap, is_running],
+            }))
+
+        points_per_driver += random_state.integers(0, 26, SYNTHETIC_NUMBER_OF_DRIVERS)
+        driver_standings.append(pd.DataFrame({
+            'raceId': race_id,
+            'driverId': driver_ids,
+            'constructorId': (driver_ids - 1) % SYNTHETIC_NUMBER_OF_CONSTRUCTORS + 1,
+            'points': points_per_driver.copy(),
+            'position': points_per_driver.argsort()[::-1].argsort() + 1,
+        }))
+
+    pd.concat(lap_times).to_csv(data_directory / LAP_TIMES_FILE, index=False)
+    pd.concat(driver_standings).to_csv(
+        data_directory / DRIVER_STANDINGS_FILE,
+        index=False,
+    )
+
+
+def start_app(llm_latency: float) -> Tuple[object, int]:
+    """
+    Starts the app on a free local port in a background thread, with the OpenAI model
+    replaced by a fake
+
+    Parameters
+    ----------
+    llm_latency
+        The time (in seconds) the fake agent takes to answer a query
+
+    Returns
+    -------
+    Tuple[object, int]
+        The server and the port it listens on
+    """
+    from werkzeug.serving import make_server
+
+    from app import api, chatbot
+
+    chatbot.ChatOpenAI = FakeChatModel
+    chatbot.create_pandas_dataframe_agent = (
+        lambda model, data, **kwargs: FakeDataFrameAgent(data, latency=llm_latency)
+    )
+    api.app.config['SECRET_KEY'] = os.urandom(32)
+
+    server = make_server('127.0.0.1', 0, api.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, server.server_port
+
+
+class Client:
+    """
+    A single user of the app, with its own session cookie and CSRF token
+    """
+    def __init__(self, base_url: str, random_state: random.Random):
+        self.base_url = base_url
+        self.random_state = random_state
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+        )
+
+    def _request(self, path: str, form_data: Dict = None) -> Tuple[int, str]:
+        data = urllib.parse.urlencode(form_data).encode() if form_data else None
+        try:
+            with self.opener.open(self.base_url + path, data=data) as response:
+                return response.status, response.read().decode()
+        except urllib.error.HTTPError as error:
+            return error.code, ''
+
+    def submit_form(
+        self,
+        path: str,
+        form_data: Dict,
+        expected_content: str,
+        record,
+    ):
+        """
+        Loads the page with the form, then posts the form with the CSRF token from the
+        page. Both requests are recorded
+        """
+        start = time.perf_counter()
+        status, page = self._request(path)
+        record(f'GET {path}', time.perf_counter() - start, status == 200)
+
+        token = CSRF_TOKEN_PATTERN.search(page)
+        if token is None:
+            record(f'POST {path}', 0.0, False)
+            return
+
+        start = time.perf_counter()
+        status, page = self._request(path, {'csrf_token': token.group(1), **form_data})
+        record(
+            f'POST {path}',
+            time.perf_counter() - start,
+            status == 200 and expected_content in page,
+        )
+
+    def run_simulation(self, record):
+        from simulation.enums import RaceName
+
+        self.submit_form(
+            '/simulation',
+            {
+                'race': self.random_state.choice(list(RaceName)).value,
+                'year': self.random_state.choice(SYNTHETIC_SEASONS),
+            },
+            expected_content='Plotly.newPlot',
+            record=record,
+        )
+
+    def ask_chatbot(self, record):
+        self.submit_form(
+            '/chatbot',
+            {
+                'api_key': 'sk-load-test',
+                'query': 'Who won the most recent championship?',
+            },
+            expected_content=FAKE_ANSWER_PREFIX,
+            record=record,
+        )
+
+    def stream_chatbot_answer(self, record, timeout: float = 60.0):
+        """
+        Asks the chatbot over the socket and records the time to the first token and
+        to the full answer. This uses the in-process SocketIO test client rather than
+        the network
+        """
+        from app.api import app, socketio
+
+        flask_client = app.test_client()
+        page = flask_client.get('/chatbot').get_data(as_text=True)
+        token = CSRF_TOKEN_PATTERN.search(page)
+        if token is None:
+            record('SOCKET first token', 0.0, False)
+            record('SOCKET answer', 0.0, False)
+            return
+
+        socket_client = socketio.test_client(app, flask_test_client=flask_client)
+        start = time.perf_counter()
+        socket_client.emit('chatbot_query', {
+            'csrf_token': token.group(1),
+            'api_key': 'sk-load-test',
+            'query': 'Who won the most recent championship?',
+        })
+
+        first_token_latency = None
+        try:
+            while time.perf_counter() - start < timeout:
+                for message in socket_client.get_received():
+                    is_first_token = (
+                        message['name'] == 'chatbot_token'
+                        and first_token_latency is None
+                    )
+                    if is_first_token:
+                        first_token_latency = time.perf_counter() - start
+                        record('SOCKET first token', first_token_latency, True)
+                    elif message['name'] == 'chatbot_answer':
+                        record('SOCKET answer', time.perf_counter() - start, True)
+                        return
+                    elif message['name'] in ('chatbot_error', 'chatbot_cancelled'):
+                        break
+                else:
+                    time.sleep(0.005)
+                    continue
+                break
+
+            if first_token_latency is None:
+                record('SOCKET first token', 0.0, False)
+            record('SOCKET answer', 0.0, False)
+        finally:
+            socket_client.disconnect()
+
+
+def _percentile(latencies: List[float], percentile: float) -> float:
+    return float(np.percentile(latencies, percentile)) * 1000 if latencies else 0.0
+
+
+def run_load_test(
+    clients: int = 8,
+    duration: float = 30.0,
+    chatbot_share: float = 0.5,
+    streaming_share: float = 0.5,
+    llm_latency: float = 0.5,
+    seed: int = 0,
+) -> Dict[str, Dict[str, float]]:
+    """
+    Runs the load test
+
+    Parameters
+    ----------
+    clients
+        The number of concurrent clients
+    duration
+        How long (in seconds) the clients keep sending requests
+    chatbot_share
+        The fraction of the clients' visits that go to the chatbot rather than the
+        simulation
+    streaming_share
+        The fraction of the chatbot visits that stream the answer over the socket
+        rather than posting the form
+    llm_latency
+        The time (in seconds) the fake agent takes to answer a query
+    seed
+        The seed for the synthetic data and the clients' choices
+
+    Returns
+    -------
+    Dict[str, Dict[str, float]]
+        The statistics for each route
+    """
+    # The synthetic data and the pre-rendered simulations are removed once the run is
+    # over. Their directories are read when the app's modules are first imported, so
+    # they have to be set before that happens
+    with tempfile.TemporaryDirectory(prefix='f1_load_test_') as directory:
+        data_directory = Path(directory) / 'data'
+        data_directory.mkdir()
+        os.environ['F1_DATA_DIRECTORY'] = str(data_directory)
+        os.environ['F1_PRERENDERED_SIMULATIONS_DIRECTORY'] = str(
+            Path(directory) / 'simulations'
+        )
+        write_synthetic_data(data_directory, seed=seed)
+
+        server, port = start_app(llm_latency=llm_latency)
+        base_url = f'http://127.0.0.1:{port}'
+
+        latencies = defaultdict(list)
+        errors = defaultdict(int)
+        lock = threading.Lock()
+
+        def record(route: str, latency: float, is_success: bool):
+            with lock:
+                if is_success:
+                    latencies[route].append(latency)
+                else:
+                    errors[route] += 1
+
+        def run_client(client_index: int):
+            client = Client(base_url, random.Random(seed + client_index))
+            end_time = time.perf_counter() + duration
+            while time.perf_counter() < end_time:
+                try:
+                    if client.random_state.random() >= chatbot_share:
+                        client.run_simulation(record)
+                    elif client.random_state.random() < streaming_share:
+                        client.stream_chatbot_answer(record)
+                    else:
+                        client.ask_chatbot(record)
+                except OSError:
+                    record('connection', 0.0, False)
+
+        start = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=clients) as executor:
+                list(executor.map(run_client, range(clients)))
+        finally:
+            server.shutdown()
+        elapsed = time.perf_counter() - start
+
+    statistics = {}
+    for route in sorted(set(latencies) | set(errors)):
+        route_latencies = latencies[route]
+        number_of_requests = len(route_latencies) + errors[route]
+        statistics[route] = {
+            'requests': number_of_requests,
+            'errors': errors[route],
+            'error_rate': errors[route] / number_of_requests,
+            'throughput': number_of_requests / elapsed,
+            'p50_ms': _percentile(route_latencies, 50),
+            'p95_ms': _percentile(route_latencies, 95),
+            'p99_ms': _percentile(route_latencies, 99),
+        }
+    return statistics
+
+
+def print_report(statistics: Dict[str, Dict[str, float]]):
+    print(
+        f'{"Route":<20}{"Requests":>10}{"Errors":>8}{"Error %":>9}{"Req/s":>9}'
+        f'{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}'
+    )
+    for route, route_statistics in statistics.items():
+        print(
+            f'{route:<20}'
+            f'{route_statistics["requests"]:>10}'
+            f'{route_statistics["errors"]:>8}'
+            f'{100 * route_statistics["error_rate"]:>9.2f}'
+            f'{route_statistics["throughput"]:>9.2f}'
+            f'{route_statistics["p50_ms"]:>10.1f}'
+            f'{route_statistics["p95_ms"]:>10.1f}'
+            f'{route_statistics["p99_ms"]:>10.1f}'
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Load tests the app offline against synthetic data',
+    )
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument(
+        '--chatbot-share',
+        type=float,
+        default=0.5,
+        help='The fraction of visits that go to the chatbot rather than the simulation',
+    )
+    parser.add_argument(
+        '--streaming-share',
+        type=float,
+        default=0.5,
+        help='The fraction of chatbot visits that stream the answer over the socket',
+    )
+    parser.add_argument(
+        '--llm-latency',
+        type=float,
+        default=0.5,
+        help='The time (in seconds) the fake agent takes to answer a query',
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--output-json',
+        help='A file to write the statistics to, as JSON',
+    )
+    parser.add_argument(
+        '--max-p99-ms',
+        type=float,
+        help='Fail if the p99 latency of any route exceeds this',
+    )
+    parser.add_argument(
+        '--max-error-rate',
+        type=float,
+        help='Fail if the error rate of any route exceeds this',
+    )
+    arguments = parser.parse_args()
+
+    statistics = run_load_test(
+        clients=arguments.clients,
+        duration=arguments.duration,
+        chatbot_share=arguments.chatbot_share,
+        streaming_share=arguments.streaming_share,
+        llm_latency=arguments.llm_latency,
+        seed=arguments.seed,
+    )
+    print_report(statistics)
+    if arguments.output_json:
+        with open(arguments.output_json, 'w') as file:
+            json.dump(statistics, file, indent=2)
+
+    failures = []
+    for route, route_statistics in statistics.items():
+        if (
+            arguments.max_p99_ms is not None
+            and route_statistics['p99_ms'] > arguments.max_p99_ms
+        ):
+            failures.append(
+                f'{route}: p99 of {route_statistics["p99_ms"]:.1f} ms exceeds '
+                f'{arguments.max_p99_ms} ms'
+            )
+        if (
+            arguments.max_error_rate is not None
+            and route_statistics['error_rate'] > arguments.max_error_rate
+        ):
+            failures.append(
+                f'{route}: error rate of {route_statistics["error_rate"]:.2%} exceeds '
+                f'{arguments.max_error_rate:.2%}'
+            )
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,7 @@
+import os
+
+PRERENDERED_SIMULATIONS_DIRECTORY = os.environ.get(
+    'F1_PRERENDERED_SIMULATIONS_DIRECTORY',
+    '/Users/emielzyde/python_personal/formula_1_analysis/prerendered_simulations',
+)
+SIMULATION_SEASONS = list(range(1994, 2023))
@@ -0,0 +1,310 @@
+"""
+Pre-renders the simulation figures for every race and season that has lap times data,
+so that the app can serve them without running the simulation on each request. Each
+figure is written as gzipped Plotly JSON, which the app serves as is.
+
+Run it with
+
+    python -m simulation.prerender --output-directory <directory> --workers <n>
+
+Only the combinations whose input data changed since the last build are rendered
+again, so the job can be re-run cheaply whenever new data is added.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from analysis.data_loading import (
+    fingerprint_data,
+    load_drivers_data,
+    load_lap_times,
+    load_races_data,
+)
+from .constants import PRERENDERED_SIMULATIONS_DIRECTORY, SIMULATION_SEASONS
+from .enums import RaceName
+from .run import run_simulation
+from constants import DRIVER_ID_STR, RACE_ID_STR
+
+MANIFEST_FILE = 'manifest.json'
+# The keys of the manifest entries that refer to artifact files, including those
+# written by earlier versions of the job
+ARTIFACT_TYPES = ('html', 'json')
+# Bump this whenever the simulation or its plot changes, so every artifact is rebuilt
+PRERENDER_VERSION = 2
+
+
+def _artifact_key(race: RaceName, season: int) -> str:
+    return f'{race.name}_{season}'
+
+
+def calculate_input_fingerprints() -> Dict[Tuple[RaceName, int], str]:
+    """
+    Calculates a fingerprint of the input data of every race and season that can be
+    simulated. Combinations without any lap times data are left out
+
+    Returns
+    -------
+    Dict[Tuple[RaceName, int], str]
+        The fingerprint for each race and season
+    """
+    races_data = load_races_data()
+    races_data = races_data[
+        races_data['name'].isin([race.value for race in RaceName])
+        & races_data['year'].isin(SIMULATION_SEASONS)
+    ]
+    lap_times = load_lap_times()
+    lap_times = lap_times[lap_times[RACE_ID_STR].isin(races_data[RACE_ID_STR])]
+    lap_times_per_race = dict(tuple(lap_times.groupby(RACE_ID_STR)))
+    drivers_data = load_drivers_data()[[DRIVER_ID_STR, 'forename', 'surname']]
+
+    fingerprints = {}
+    for _, race_row in races_data.iterrows():
+        lap_times_for_race = lap_times_per_race.get(race_row[RACE_ID_STR])
+        if lap_times_for_race is None:
+            continue
+
+        hasher = hashlib.blake2b(digest_size=16)
+        hasher.update(str(PRERENDER_VERSION).encode())
+        input_data = [
+            race_row[[RACE_ID_STR, 'year', 'name', 'date']].to_frame().T,
+            lap_times_for_race,
+            drivers_data[
+                drivers_data[DRIVER_ID_STR].isin(lap_times_for_race[DRIVER_ID_STR])
+            ],
+        ]
+        for data in input_data:
+            hasher.update(fingerprint_data(data.reset_index(drop=True)).encode())
+        fingerprints[(RaceName(race_row['name']), int(race_row['year']))] = (
+            hasher.hexdigest()
+        )
+
+    return fingerprints
+
+
+def _write_compressed(path: Path, content: str):
+    temporary_path = path.with_name(path.name + '.tmp')
+    with gzip.open(temporary_path, 'wt', encoding='utf-8') as file:
+        file.write(content)
+    os.replace(temporary_path, path)
+
+
+def _render_simulation(race_value: str, season: int, output_directory: str) -> Dict:
+    """
+    Renders a single simulation and writes the compressed figure JSON to the output
+    directory. This runs in a worker process
+
+    Returns
+    -------
+    Dict
+        The paths of the written artifacts, relative to the output directory
+    """
+    race = RaceName(race_value)
+    key = _artifact_key(race, season)
+    figure = run_simulation(race=race, reference_season=season)
+
+    json_file = f'{key}.json.gz'
+    _write_compressed(Path(output_directory) / json_file, figure.to_json())
+    return {'json': json_file}
+
+
+def _read_manifest(output_directory: Path) -> Dict:
+    manifest_path = output_directory / MANIFEST_FILE
+    if not manifest_path.exists():
+        return {'version': PRERENDER_VERSION, 'simulations': {}}
+    with open(manifest_path) as file:
+        return json.load(file)
+
+
+def _write_manifest(output_directory: Path, manifest: Dict):
+    manifest_path = output_directory / MANIFEST_FILE
+    temporary_path = manifest_path.with_name(MANIFEST_FILE + '.tmp')
+    with open(temporary_path, 'w') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(temporary_path, manifest_path)
+
+
+def _remove_unreferenced_artifacts(
+    output_directory: Path,
+    previous_simulations: Dict,
+    simulations: Dict,
+):
+    """
+    Removes the artifacts of the previous manifest that the new manifest no longer
+    refers to, e.g. those of combinations that no longer have data or failed to render
+    """
+    referenced_files = {
+        file
+        for entry in simulations.values()
+        for artifact, file in entry.items()
+        if artifact in ARTIFACT_TYPES
+    }
+    for entry in previous_simulations.values():
+        for artifact, file in entry.items():
+            if artifact in ARTIFACT_TYPES and file not in referenced_files:
+                (output_directory / file).unlink(missing_ok=True)
+
+
+def prerender_simulations(
+    output_directory: str = PRERENDERED_SIMULATIONS_DIRECTORY,
+    workers: Optional[int] = None,
+    force: bool = False,
+) -> Dict:
+    """
+    Pre-renders the simulation for every race and season that has data, in parallel.
+    Combinations whose input fingerprint matches the one in the existing manifest are
+    skipped, unless `force` is set
+
+    Parameters
+    ----------
+    output_directory
+        The directory the artifacts and the manifest are written to
+    workers
+        The number of worker processes. Defaults to the number of CPUs
+    force
+        Whether to render every combination, even if its inputs did not change
+
+    Returns
+    -------
+    Dict
+        The updated manifest
+    """
+    output_path = Path(output_directory)
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    manifest = _read_manifest(output_path)
+    previous_simulations = manifest['simulations']
+    fingerprints = calculate_input_fingerprints()
+
+    simulations = {}
+    stale_combinations = []
+    for (race, season), fingerprint in fingerprints.items():
+        key = _artifact_key(race, season)
+        previous_entry = previous_simulations.get(key)
+        is_up_to_date = (
+            not force
+            and previous_entry is not None
+            and previous_entry['fingerprint'] == fingerprint
+            and 'json' in previous_entry
+            and (output_path / previous_entry['json']).exists()
+        )
+        if is_up_to_date:
+            simulations[key] = {
+                field: previous_entry[field]
+                for field in ('race', 'season', 'fingerprint', 'json')
+            }
+        else:
+            stale_combinations.append((race, season, fingerprint))
+
+    print(
+        f'Rendering {len(stale_combinations)} of {len(fingerprints)} simulations, '
+        f'{len(fingerprints) - len(stale_combinations)} are up to date'
+    )
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_render_simulation, race.value, season, str(output_path)): (
+                race, season, fingerprint
+            )
+            for race, season, fingerprint in stale_combinations
+        }
+        for future in as_completed(futures):
+            race, season, fingerprint = futures[future]
+            try:
+                artifacts = future.result()
+            except Exception as error:
+                print(f'Failed to render the {season} {race.value}: {error!r}')
+                continue
+            simulations[_artifact_key(race, season)] = {
+                'race': race.value,
+                'season': season,
+                'fingerprint': fingerprint,
+                **artifacts,
+            }
+
+    manifest = {'version': PRERENDER_VERSION, 'simulations': simulations}
+    _write_manifest(output_path, manifest)
+    _remove_unreferenced_artifacts(output_path, previous_simulations, simulations)
+    return manifest
+
+
+@lru_cache(maxsize=1)
+def _load_manifest(output_directory: str, manifest_modification_time: int) -> Dict:
+    return _read_manifest(Path(output_directory))
+
+
+def get_prerendered_simulation_path(
+    race: RaceName,
+    season: int,
+    output_directory: str = PRERENDERED_SIMULATIONS_DIRECTORY,
+) -> Optional[Path]:
+    """
+    Returns the path of the gzipped figure JSON of a pre-rendered simulation, if one
+    was built. The file can be served as is, with a gzip content encoding
+
+    Parameters
+    ----------
+    race
+        The simulated race
+    season
+        The season used as a reference for the simulation
+    output_directory
+        The directory the artifacts were written to
+
+    Returns
+    -------
+    Optional[Path]
+        The path of the figure JSON, or None if the simulation was not pre-rendered
+    """
+    manifest_path = Path(output_directory) / MANIFEST_FILE
+    try:
+        manifest_modification_time = manifest_path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    manifest = _load_manifest(output_directory, manifest_modification_time)
+    if manifest.get('version') != PRERENDER_VERSION:
+        return None
+    entry = manifest['simulations'].get(_artifact_key(race, season))
+    if entry is None:
+        return None
+
+    json_path = Path(output_directory) / entry['json']
+    return json_path if json_path.exists() else None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Pre-renders the simulation figures served by the app',
+    )
+    parser.add_argument(
+        '--output-directory',
+        default=PRERENDERED_SIMULATIONS_DIRECTORY,
+        help='The directory the artifacts and the manifest are written to',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='The number of worker processes. Defaults to the number of CPUs',
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Render every simulation, even if its inputs did not change',
+    )
+    arguments = parser.parse_args()
+    prerender_simulations(
+        output_directory=arguments.output_directory,
+        workers=arguments.workers,
+        force=arguments.force,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+import gzip
+import io
+from functools import lru_cache
+from typing import Dict, Optional
+
+import numpy as np
+
+from analysis.data_loading import get_data_version, load_lap_times, load_races_data
+from .enums import RaceName
+from .run import calculate_gaps_to_first, load_reference_lap_times
+from constants import RACE_ID_STR
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bump this whenever the layout of the payload changes, so that cached replays are
+# invalidated
+REPLAY_FORMAT_VERSION = 1
+IDENTITY_ENCODING = 'identity'
+GZIP_ENCODING = 'gzip'
+BROTLI_ENCODING = 'br'
+
+
+def supported_encodings():
+    """
+    Returns the content encodings that replays can be served with, in order of
+    preference. Brotli is only supported if the `brotli` package is installed
+    """
+    encodings = [GZIP_ENCODING, IDENTITY_ENCODING]
+    if brotli is not None:
+        encodings.insert(0, BROTLI_ENCODING)
+    return encodings
+
+
+def get_race_replay_version(race: RaceName, season: int) -> str:
+    """
+    Returns the version of a race replay, which changes whenever the data it is built
+    from, the version of `load_reference_lap_times` or the layout of the payload
+    changes. This is cheap to compute once the data has been loaded, so it can be used
+    to answer conditional requests without building the replay
+
+    Parameters
+    ----------
+    race
+        The race
+    season
+        The season in which the race took place
+
+    Returns
+    -------
+    str
+        The version of the replay
+    """
+    data_version = get_data_version(*load_reference_lap_times.sources)
+    return (
+        f'{REPLAY_FORMAT_VERSION}-{load_reference_lap_times.version}-{race.name}-'
+        f'{season}-{data_version}'
+    )
+
+
+@lru_cache(maxsize=1)
+def _races_with_lap_times(data_version: str) -> frozenset:
+    # The data version is part of the cache key, so that the races are looked up again
+    # after the data changes
+    races_data = load_races_data()
+    lap_times = load_lap_times()
+    races_data = races_data[
+        races_data[RACE_ID_STR].isin(lap_times[RACE_ID_STR].unique())
+    ]
+    return frozenset(zip(races_data['name'], races_data['year'].astype(int)))
+
+
+def has_race_replay(race: RaceName, season: int) -> bool:
+    """
+    Checks whether there are lap times for a race, i.e. whether it has a replay. After
+    the first call, this is a set lookup, so it can be used to answer conditional
+    requests without building the replay
+
+    Parameters
+    ----------
+    race
+        The race
+    season
+        The season in which the race took place
+
+    Returns
+    -------
+    bool
+        Whether the race has a replay
+    """
+    data_version = get_data_version(*load_reference_lap_times.sources)
+    return (race.value, season) in _races_with_lap_times(data_version)
+
+
+def build_race_replay_matrices(race: RaceName, season: int) -> Optional[Dict]:
+    """
+    Builds the lap by driver matrices of the positions and the gaps to the leader for
+    a race. The drivers are ordered by where they finished the race. Laps that a driver
+    did not complete have a position of 0 and a gap of NaN
+
+    Parameters
+    ----------
+    race
+        The race
+    season
+        The season in which the race took place
+
+    Returns
+    -------
+    Optional[Dict]
+        The laps, drivers, positions and gaps (in seconds), or None if there is no data
+        for the race
+    """
+    lap_times = load_reference_lap_times(race=race, season=season)
+    if lap_times.empty:
+        return None
+
+    lap_times = calculate_gaps_to_first(lap_times)
+
+    final_laps = lap_times.groupby('driver_name').tail(1)
+    driver_names = final_laps.sort_values(
+        by=['lap', 'position'],
+        ascending=[False, True],
+    )['driver_name'].to_numpy()
+    laps = np.arange(1, lap_times['lap'].max() + 1)
+
+    positions = lap_times.pivot_table(
+        index='lap',
+        columns='driver_name',
+        values='position',
+    ).reindex(index=laps, columns=driver_names)
+    gaps = lap_times.pivot_table(
+        index='lap',
+        columns='driver_name',
+        values='gap_to_first',
+    ).reindex(index=laps, columns=driver_names)
+
+    return {
+        'laps': laps.astype(np.int16),
+        'drivers': driver_names.astype(str),
+        'positions': positions.fillna(0).to_numpy(dtype=np.int8),
+        'gaps': gaps.to_numpy(dtype=np.float32),
+    }
+
+
+def _compress(payload: bytes, encoding: str) -> bytes:
+    if encoding == BROTLI_ENCODING:
+        return brotli.compress(payload)
+    if encoding == GZIP_ENCODING:
+        return gzip.compress(payload, mtime=0)
+    return payload
+
+
+@lru_cache(maxsize=64)
+def _build_race_replay_payload(
+    race: RaceName,
+    season: int,
+    version: str,
+    encoding: str,
+) -> Optional[bytes]:
+    # The version is part of the cache key, so that replays are rebuilt after the data
+    # changes
+    matrices = build_race_replay_matrices(race=race, season=season)
+    if matrices is None:
+        return None
+
+    buffer = io.BytesIO()
+    np.savez(buffer, **matrices)
+    return _compress(buffer.getvalue(), encoding)
+
+
+def build_race_replay_payload(
+    race: RaceName,
+    season: int,
+    encoding: str = IDENTITY_ENCODING,
+) -> Optional[bytes]:
+    """
+    Builds the replay of a race as a NumPy `.npz` archive with the arrays `laps`,
+    `drivers`, `positions` and `gaps` (see `build_race_replay_matrices`), compressed
+    with the given content encoding. Recently built payloads are cached
+
+    Parameters
+    ----------
+    race
+        The race
+    season
+        The season in which the race took place
+    encoding
+        One of the `supported_encodings`
+
+    Returns
+    -------
+    Optional[bytes]
+        The payload, or None if there is no data for the race
+    """
+    return _build_race_replay_payload(
+        race,
+        season,
+        get_race_replay_version(race, season),
+        encoding,
+    )
@@ -2,42 +2,20 @@ import pandas as pd
 from typing import Optional
 
 import plotly.graph_objects as go
+import plotly.offline as pyo
 
 from analysis.data_loading import load_lap_times, load_races_data, load_drivers_data
+from analysis.memoization import memoize_derived
 from .enums import RaceName, PlottingVariable
 from constants import DRIVER_ID_STR, RACE_ID_STR
 
 
-def _calculate_gap_to_first_for_lap(data_for_lap: pd.DataFrame):
-    """
-    For a given lap, calculates the gap (in seconds) between each driver and the first
-    driver in the race
-
-    Parameters
-    ----------
-    data_for_lap
-        The data for the lap
-
-    Returns
-    -------
-
-    """
-    gaps_to_first = []
-    time_of_first_driver = data_for_lap[data_for_lap['position'] == 1]['cumulative_time'].values[0]
-    for idx, row in data_for_lap.iterrows():
-        if row['position'] == 1:
-            gaps_to_first.append(0)
-        else:
-            diff = (row['cumulative_time'] - time_of_first_driver) / 1000
-            gaps_to_first.append(diff)
-
-    return pd.Series(gaps_to_first)
-
-
 def calculate_gaps_to_first(lap_times_data: pd.DataFrame) -> pd.DataFrame:
     """
     For each lap in the race, calculate the time each driver is behind the first in the
-    race
+    race. The cumulative time of the leader on each lap is subtracted from the
+    cumulative times of all drivers on that lap, so this works for any number of
+    drivers per lap
 
     Parameters
     ----------
@@ -50,14 +28,24 @@ def calculate_gaps_to_first(lap_times_data: pd.DataFrame) -> pd.DataFrame:
     pd.DataFrame
         The lap times data with the gaps to first (in seconds) added
     """
-    sorted_data = lap_times_data.sort_values(by=['lap', 'position'], axis=0, ascending=[True, True]).reset_index(drop=True)
-    sorted_data['cumulative_time'] = sorted_data.groupby('driver_name')['milliseconds'].cumsum()
-    gaps_to_first = sorted_data.groupby('lap').apply(_calculate_gap_to_first_for_lap).reset_index(drop=True)
-    gaps_to_first.name = 'gap_to_first'
-    merged_data = pd.merge(sorted_data, gaps_to_first, left_index=True, right_index=True)
-    return merged_data
+    sorted_data = (
+        lap_times_data
+        .sort_values(by=['lap', 'position'], ascending=[True, True])
+        .reset_index(drop=True)
+    )
+    cumulative_times = sorted_data.groupby('driver_name')['milliseconds'].cumsum()
+    leader_times = (
+        cumulative_times[sorted_data['position'] == 1]
+        .groupby(sorted_data['lap'])
+        .first()
+    )
+    return sorted_data.assign(
+        cumulative_time=cumulative_times,
+        gap_to_first=(cumulative_times - sorted_data['lap'].map(leader_times)) / 1000,
+    )
 
 
+@memoize_derived(load_lap_times, load_races_data, load_drivers_data, version=1)
 def load_reference_lap_times(race: RaceName, season: int) -> pd.DataFrame:
     """
     Load the reference lap times to use for the simulation
@@ -211,9 +199,30 @@ def run_simulation(race: RaceName, reference_season: int):
     """
 
     reference_lap_times = load_reference_lap_times(race=race, season=reference_season)
-    calculate_gaps_to_first(lap_times_data=reference_lap_times)
     return plot_simulation(
         reference_lap_times,
         number_of_drivers=5,
         variable_to_plot=PlottingVariable.gap_to_first,
     )
+
+
+def render_simulation_div(figure) -> str:
+    """
+    Renders a simulation figure as an HTML div that can be embedded in a page
+
+    Parameters
+    ----------
+    figure
+        The figure returned by `run_simulation`
+
+    Returns
+    -------
+    str
+        The HTML div
+    """
+    return pyo.offline.plot(
+        figure,
+        include_plotlyjs=False,
+        output_type='div',
+        auto_play=False,
+    )
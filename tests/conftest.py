@@ -0,0 +1,15 @@
+import os
+import tempfile
+from pathlib import Path
+
+# The data directory is read when the analysis modules are first imported, so it has to
+# point at the synthetic data before any test imports them
+_data_directory = Path(tempfile.mkdtemp(prefix='f1_test_data_'))
+os.environ['F1_DATA_DIRECTORY'] = str(_data_directory)
+os.environ['F1_PRERENDERED_SIMULATIONS_DIRECTORY'] = tempfile.mkdtemp(
+    prefix='f1_test_simulations_',
+)
+
+from app.load_test import write_synthetic_data  # noqa: E402
+
+write_synthetic_data(_data_directory)
@@ -0,0 +1,124 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app import chatbot
+from app.api import app, socketio
+from app.load_test import (
+    CSRF_TOKEN_PATTERN,
+    FAKE_ANSWER_PREFIX,
+    FAKE_TOOL,
+    FakeChatModel,
+    FakeDataFrameAgent,
+)
+
+FINAL_EVENTS = ('chatbot_answer', 'chatbot_cancelled', 'chatbot_error')
+
+
+@pytest.fixture
+def fake_agents(monkeypatch):
+    """
+    Replaces the LLM with the stand-in from the load-test harness, and records the
+    agents that are created
+    """
+    fake_agents = SimpleNamespace(latency=0.1, created=[])
+
+    def create_fake_agent(model, data, **kwargs):
+        agent = FakeDataFrameAgent(data, latency=fake_agents.latency)
+        fake_agents.created.append(agent)
+        return agent
+
+    monkeypatch.setattr(chatbot, 'ChatOpenAI', FakeChatModel)
+    monkeypatch.setattr(chatbot, 'create_pandas_dataframe_agent', create_fake_agent)
+    monkeypatch.setitem(app.config, 'SECRET_KEY', 'test')
+    return fake_agents
+
+
+@pytest.fixture
+def socket_client(fake_agents):
+    flask_client = app.test_client()
+    page = flask_client.get('/chatbot').get_data(as_text=True)
+    client = socketio.test_client(app, flask_test_client=flask_client)
+    client.csrf_token = CSRF_TOKEN_PATTERN.search(page).group(1)
+    yield client
+    if client.is_connected():
+        client.disconnect()
+
+
+def _send_query(client, csrf_token=None):
+    client.emit('chatbot_query', {
+        'csrf_token': csrf_token or client.csrf_token,
+        'api_key': 'sk-test',
+        'query': 'How many rows are there?',
+    })
+
+
+def _receive_until(client, event_names, timeout=5.0):
+    received = []
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        received.extend(client.get_received())
+        if any(message['name'] in event_names for message in received):
+            return received
+        time.sleep(0.01)
+    raise AssertionError(f'None of {event_names} was received, only {received}')
+
+
+def test_query_streams_steps_tokens_and_answer(socket_client):
+    _send_query(socket_client)
+    received = _receive_until(socket_client, FINAL_EVENTS)
+
+    names = [message['name'] for message in received]
+    assert names[-1] == 'chatbot_answer'
+    steps = [
+        message['args'][0]
+        for message in received
+        if message['name'] == 'chatbot_step'
+    ]
+    assert steps[0]['tool'] == FAKE_TOOL
+    assert 'observation' in steps[1]
+    tokens = ''.join(
+        message['args'][0]['token']
+        for message in received
+        if message['name'] == 'chatbot_token'
+    )
+    answer = received[-1]['args'][0]['answer']
+    assert tokens.strip() in answer
+    assert FAKE_ANSWER_PREFIX in answer
+
+
+def test_cancel_stops_running_query(socket_client, fake_agents):
+    fake_agents.latency = 2.0
+    _send_query(socket_client)
+    _receive_until(socket_client, ('chatbot_token',))
+
+    socket_client.emit('chatbot_cancel')
+    received = _receive_until(socket_client, FINAL_EVENTS)
+    assert received[-1]['name'] == 'chatbot_cancelled'
+
+
+def test_cancel_while_waiting_for_slot_gives_up_place(socket_client, fake_agents):
+    for _ in range(chatbot.MAX_CONCURRENT_AGENT_RUNS):
+        chatbot._agent_run_slots.acquire()
+    try:
+        _send_query(socket_client)
+        time.sleep(0.2)
+        start = time.monotonic()
+        socket_client.emit('chatbot_cancel')
+        received = _receive_until(socket_client, FINAL_EVENTS, timeout=2.0)
+        assert time.monotonic() - start < 1.0
+    finally:
+        for _ in range(chatbot.MAX_CONCURRENT_AGENT_RUNS):
+            chatbot._agent_run_slots.release()
+
+    assert received[-1]['name'] == 'chatbot_cancelled'
+    assert fake_agents.created == []
+
+
+def test_query_with_invalid_csrf_token_is_rejected(socket_client, fake_agents):
+    _send_query(socket_client, csrf_token='invalid')
+    received = _receive_until(socket_client, FINAL_EVENTS)
+
+    assert received[-1]['name'] == 'chatbot_error'
+    assert fake_agents.created == []
@@ -0,0 +1,37 @@
+import pandas as pd
+import plotly.graph_objects as go
+
+from analysis.data_loading import load_races_data
+from analysis.enums import StandingsDataType
+from analysis.preliminary_analysis import (
+    construct_driver_standings_data,
+    plot_standings_data_over_time,
+)
+
+
+def test_changes_to_a_loaded_table_do_not_reach_other_callers():
+    original_data = load_races_data()
+    original_name = original_data['name'].iloc[0]
+
+    data = load_races_data()
+    data['new_column'] = 1
+    data.iloc[0, data.columns.get_loc('name')] = 'Modified Grand Prix'
+
+    reloaded_data = load_races_data()
+    assert 'new_column' not in reloaded_data.columns
+    assert reloaded_data['name'].iloc[0] == original_name
+    pd.testing.assert_frame_equal(reloaded_data, original_data)
+
+
+def test_plotting_standings_does_not_modify_its_input(monkeypatch):
+    monkeypatch.setattr(go.Figure, 'show', lambda figure: None)
+    standings_data = construct_driver_standings_data()
+    date_dtype = standings_data['date'].dtype
+
+    plot_standings_data_over_time(
+        standings_data,
+        year=int(standings_data['year'].iloc[0]),
+        standings_data_type=StandingsDataType.drivers,
+    )
+    assert standings_data['date'].dtype == date_dtype
+    assert construct_driver_standings_data()['date'].dtype == date_dtype
@@ -0,0 +1,146 @@
+import os
+
+import pandas as pd
+import pytest
+
+from analysis import memoization
+from analysis.data_loading import shared_table
+from analysis.memoization import DerivedTablesCache, memoize_derived
+
+
+def _make_table(number_of_rows: int) -> pd.DataFrame:
+    return pd.DataFrame({'value': range(number_of_rows)}, dtype='int64')
+
+
+def _table_size(data: pd.DataFrame) -> int:
+    return int(data.memory_usage(index=True, deep=True).sum())
+
+
+def test_least_recently_used_tables_are_evicted_by_size():
+    small_table, large_table = _make_table(10), _make_table(1000)
+    cache = DerivedTablesCache(
+        max_bytes=2 * _table_size(small_table) + _table_size(large_table),
+    )
+    cache.put('first', small_table)
+    cache.put('second', small_table)
+    cache.put('large', large_table)
+    assert cache.get('first') is small_table
+
+    # Only the second table has to go to make room, as it is the least recently used
+    cache.put('third', small_table)
+    assert cache.get('second') is None
+    assert cache.get('first') is small_table
+    assert cache.get('large') is large_table
+    assert cache.get('third') is small_table
+
+    # A table bigger than the whole cache pushes out everything, including itself
+    cache.put('huge', _make_table(10_000))
+    for key in ('first', 'large', 'third', 'huge'):
+        assert cache.get(key) is None
+
+
+def test_evicted_tables_are_spilled_and_read_back(tmp_path):
+    table = _make_table(100)
+    cache = DerivedTablesCache(max_bytes=_table_size(table), spill_directory=tmp_path)
+    cache.put('first', table)
+    cache.put('second', table.copy())
+    assert list(tmp_path.iterdir()) == [tmp_path / 'first.pkl']
+
+    cache.clear()
+    pd.testing.assert_frame_equal(cache.get('first'), table)
+    assert cache.get('unknown') is None
+
+
+def test_spill_directory_is_pruned_to_its_limit(tmp_path):
+    table = _make_table(100)
+    cache = DerivedTablesCache(max_bytes=0, spill_directory=tmp_path)
+    cache.put('first', table)
+    spill_file_size = (tmp_path / 'first.pkl').stat().st_size
+    cache.spill_max_bytes = 2 * spill_file_size
+    cache.put('second', table)
+    # Reading a table back makes it the most recently used one on disk
+    os.utime(tmp_path / 'first.pkl', (0, 0))
+    os.utime(tmp_path / 'second.pkl', (1, 1))
+    assert cache.get('first') is not None
+
+    cache.put('third', table)
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        'first.pkl',
+        'third.pkl',
+    ]
+
+
+@pytest.fixture
+def memoized_builder(monkeypatch):
+    """
+    A memoized builder that sums the tables of two loaders, and counts its calls. The
+    tables the loaders return can be swapped out through `tables`
+    """
+    monkeypatch.setattr(
+        memoization,
+        'derived_tables_cache',
+        DerivedTablesCache(max_bytes=1024 * 1024),
+    )
+    tables = {
+        'first': _make_table(10),
+        'second': _make_table(10),
+        'unrelated': _make_table(10),
+    }
+    calls = []
+
+    @shared_table
+    def load_first():
+        return tables['first']
+
+    @shared_table
+    def load_second():
+        return tables['second']
+
+    @shared_table
+    def load_unrelated():
+        return tables['unrelated']
+
+    @memoize_derived(load_first, load_second, version=1)
+    def build_sum(offset: int = 0) -> pd.DataFrame:
+        calls.append(offset)
+        return load_first() + load_second() + offset
+
+    build_sum.tables = tables
+    build_sum.calls = calls
+    build_sum.loaders = (load_first, load_second, load_unrelated)
+    return build_sum
+
+
+def test_table_is_built_once_per_arguments(memoized_builder):
+    first_result = memoized_builder()
+    first_result['value'] = 0
+    assert memoized_builder()['value'].tolist() == list(range(0, 20, 2))
+    memoized_builder(offset=1)
+    assert memoized_builder.calls == [0, 1]
+
+
+def test_table_is_rebuilt_when_a_source_changes(memoized_builder):
+    load_first, _, _ = memoized_builder.loaders
+    memoized_builder()
+
+    # Reloading an unchanged table keeps its fingerprint
+    load_first.cache_clear()
+    memoized_builder()
+    assert memoized_builder.calls == [0]
+
+    memoized_builder.tables['first'] = _make_table(10) + 100
+    load_first.cache_clear()
+    assert memoized_builder()['value'].iloc[0] == 100
+    assert memoized_builder.calls == [0, 0]
+
+
+def test_table_is_not_rebuilt_when_an_unrelated_table_changes(memoized_builder):
+    _, _, load_unrelated = memoized_builder.loaders
+    memoized_builder()
+    load_unrelated()
+
+    memoized_builder.tables['unrelated'] = _make_table(10) + 100
+    load_unrelated.cache_clear()
+    load_unrelated()
+    memoized_builder()
+    assert memoized_builder.calls == [0]
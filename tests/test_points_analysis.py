@@ -0,0 +1,242 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from analysis.enums import StandingsDataType
+from analysis.points_analysis import (
+    CONSTRUCTOR_ID_COL,
+    CONVERTED_COL,
+    DRIVER_ID_COL,
+    FINISH_POSITION_COL,
+    POSITIONS_GAINED_COL,
+    QUALIFYING_POSITION_COL,
+    _calculate_quantiles,
+    _draw_resampled_indices,
+    _rank_within_groups,
+    calculate_qualifying_vs_race_statistics,
+)
+
+DRIVER_NAME_COL = StandingsDataType.drivers.value
+
+
+def _make_joined_data(
+    driver_ids,
+    driver_names,
+    qualifying_positions,
+    finish_positions,
+) -> pd.DataFrame:
+    """
+    Makes data in the shape returned by `join_qualifying_and_results`
+    """
+    qualifying_positions = np.asarray(qualifying_positions, dtype=float)
+    finish_positions = np.asarray(finish_positions)
+    return pd.DataFrame({
+        DRIVER_ID_COL: driver_ids,
+        CONSTRUCTOR_ID_COL: np.asarray(driver_ids) % 2,
+        DRIVER_NAME_COL: driver_names,
+        StandingsDataType.constructors.value: [
+            f'Constructor {driver_id % 2}' for driver_id in driver_ids
+        ],
+        QUALIFYING_POSITION_COL: qualifying_positions,
+        FINISH_POSITION_COL: finish_positions,
+        POSITIONS_GAINED_COL: qualifying_positions - finish_positions,
+        CONVERTED_COL: finish_positions <= qualifying_positions,
+    })
+
+
+@pytest.fixture
+def joined_data():
+    random_state = np.random.default_rng(0)
+    driver_ids = np.repeat([3, 1, 2, 4], [12, 8, 15, 1])
+    qualifying_positions = random_state.integers(1, 21, len(driver_ids))
+    finish_positions = np.clip(
+        qualifying_positions + random_state.integers(-4, 5, len(driver_ids)),
+        1,
+        20,
+    )
+    return _make_joined_data(
+        driver_ids,
+        [f'Driver {driver_id}' for driver_id in driver_ids],
+        qualifying_positions,
+        finish_positions,
+    )
+
+
+@pytest.mark.filterwarnings('ignore::RuntimeWarning')
+def test_statistics_match_groupby(joined_data):
+    statistics = calculate_qualifying_vs_race_statistics(
+        joined_data,
+        StandingsDataType.drivers,
+        number_of_resamples=50,
+        seed=0,
+    ).set_index(DRIVER_ID_COL).sort_index()
+
+    grouped_data = joined_data.groupby(DRIVER_ID_COL)
+    expected_rank_correlations = grouped_data[
+        [QUALIFYING_POSITION_COL, FINISH_POSITION_COL]
+    ].apply(
+        lambda data: data[QUALIFYING_POSITION_COL].rank().corr(
+            data[FINISH_POSITION_COL].rank(),
+        ),
+    )
+    pd.testing.assert_series_equal(
+        statistics['races'],
+        grouped_data.size(),
+        check_names=False,
+    )
+    pd.testing.assert_series_equal(
+        statistics['mean_positions_gained'],
+        grouped_data[POSITIONS_GAINED_COL].mean(),
+        check_names=False,
+    )
+    pd.testing.assert_series_equal(
+        statistics['conversion_rate'],
+        grouped_data[CONVERTED_COL].mean(),
+        check_names=False,
+    )
+    pd.testing.assert_series_equal(
+        statistics['rank_correlation'],
+        expected_rank_correlations,
+        check_names=False,
+    )
+    # A driver with a single race has no rank correlation
+    assert np.isnan(statistics.loc[4, 'rank_correlation_lower'])
+
+
+def test_intervals_contain_the_estimates(joined_data):
+    statistics = calculate_qualifying_vs_race_statistics(
+        joined_data,
+        StandingsDataType.drivers,
+        seed=0,
+    ).dropna()
+
+    for statistic in ('mean_positions_gained', 'conversion_rate', 'rank_correlation'):
+        assert (statistics[f'{statistic}_lower'] <= statistics[statistic] + 1e-9).all()
+        assert (statistics[statistic] <= statistics[f'{statistic}_upper'] + 1e-9).all()
+
+
+def test_fixed_seed_gives_the_same_intervals(joined_data):
+    statistics, same_seed_statistics, other_seed_statistics = (
+        calculate_qualifying_vs_race_statistics(
+            joined_data,
+            StandingsDataType.drivers,
+            number_of_resamples=200,
+            seed=seed,
+        )
+        for seed in (1, 1, 2)
+    )
+
+    pd.testing.assert_frame_equal(statistics, same_seed_statistics)
+    assert not statistics.equals(other_seed_statistics)
+
+
+def test_drivers_with_the_same_name_are_kept_apart():
+    joined_data = _make_joined_data(
+        driver_ids=[7, 7, 7, 9, 9],
+        driver_names=['Michael Schumacher'] * 3 + ['Michael Schumacher'] * 2,
+        qualifying_positions=[1, 2, 3, 10, 12],
+        finish_positions=[1, 1, 2, 14, 15],
+    )
+    statistics = calculate_qualifying_vs_race_statistics(
+        joined_data,
+        StandingsDataType.drivers,
+        number_of_resamples=10,
+        seed=0,
+    ).set_index(DRIVER_ID_COL)
+
+    assert statistics[DRIVER_NAME_COL].tolist() == ['Michael Schumacher'] * 2
+    assert statistics.loc[7, 'races'] == 3
+    assert statistics.loc[9, 'races'] == 2
+    assert statistics.loc[9, 'mean_positions_gained'] == pytest.approx(-3.5)
+
+
+def test_quantiles_match_nanquantile():
+    values = np.random.default_rng(0).normal(size=(200, 4))
+    values[::3, 1] = np.nan
+    values[:-1, 2] = np.nan
+    values[:, 3] = np.nan
+    quantiles = np.array([0.025, 0.5, 0.975])
+
+    with pytest.warns(RuntimeWarning):
+        expected_quantiles = np.nanquantile(values, quantiles, axis=0)
+    np.testing.assert_allclose(
+        _calculate_quantiles(values, quantiles),
+        expected_quantiles,
+    )
+
+
+class _AlmostOneRandomState:
+    """
+    Always draws the largest single-precision number below one
+    """
+    def random(self, shape, dtype):
+        return np.full(shape, np.nextafter(dtype(1), dtype(0)), dtype=dtype)
+
+
+def _group_starts(group_sizes: np.ndarray) -> np.ndarray:
+    return np.concatenate([[0], np.cumsum(group_sizes)[:-1]])
+
+
+def test_drawn_indices_stay_within_their_group():
+    group_sizes = np.array([1, 3, 1, 50_000, 1, 2])
+    group_starts = _group_starts(group_sizes)
+    row_group_starts = np.repeat(group_starts, group_sizes)
+    row_group_ends = row_group_starts + np.repeat(group_sizes, group_sizes)
+
+    resampled_indices = _draw_resampled_indices(
+        group_starts,
+        group_sizes,
+        number_of_resamples=20,
+        random_state=np.random.default_rng(0),
+    )
+
+    assert resampled_indices.shape == (20, group_sizes.sum())
+    assert (resampled_indices >= row_group_starts).all()
+    assert (resampled_indices < row_group_ends).all()
+    # Groups with a single row can only draw that row
+    for group_start in group_starts[group_sizes == 1]:
+        assert (resampled_indices[:, group_start] == group_start).all()
+
+
+def test_largest_draw_gives_the_last_row_of_the_group():
+    # Includes sizes just below and above powers of two, where single precision
+    # rounding is coarsest relative to the size
+    group_sizes = np.array([1, 3, 1, 2 ** 21 - 1, 7, 2 ** 22 + 1])
+    group_starts = _group_starts(group_sizes)
+
+    resampled_indices = _draw_resampled_indices(
+        group_starts,
+        group_sizes,
+        number_of_resamples=1,
+        random_state=_AlmostOneRandomState(),
+    )
+
+    np.testing.assert_array_equal(
+        resampled_indices[0],
+        np.repeat(group_starts + group_sizes - 1, group_sizes),
+    )
+
+
+def test_ranks_match_pandas_ranks():
+    random_state = np.random.default_rng(0)
+    group_sizes = np.array([5, 1, 12, 7])
+    row_group_codes = np.repeat(np.arange(len(group_sizes)), group_sizes)
+    positions = random_state.integers(1, 6, (3, group_sizes.sum()))
+    unique_positions, codes = np.unique(positions, return_inverse=True)
+    codes = codes.reshape(positions.shape)
+
+    ranks = _rank_within_groups(
+        row_group_codes * len(unique_positions) + codes,
+        group_sizes,
+        len(unique_positions),
+    )
+
+    for sample_positions, sample_ranks in zip(positions, ranks):
+        expected_ranks = (
+            pd.Series(sample_positions).groupby(row_group_codes).rank()
+        )
+        row_group_sizes = np.repeat(group_sizes, group_sizes)
+        np.testing.assert_array_equal(
+            sample_ranks,
+            2 * expected_ranks - (row_group_sizes + 1),
+        )
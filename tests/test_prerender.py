@@ -0,0 +1,161 @@
+import gzip
+import json
+import re
+from functools import partial
+
+import pytest
+
+from app import api
+from app.api import app
+from app.load_test import SYNTHETIC_SEASONS
+from simulation import prerender
+from simulation.prerender import MANIFEST_FILE, prerender_simulations
+
+# Rendering every synthetic race takes a while, so only the first few are rendered
+NUMBER_OF_SIMULATIONS = 2
+SEASON_WITHOUT_DATA = SYNTHETIC_SEASONS[0] - 1
+RENDERING_PATTERN = re.compile(r'Rendering (\d+) of (\d+) simulations')
+
+
+@pytest.fixture
+def simulations(monkeypatch):
+    """
+    Limits the pre-render job to the first few races and seasons with data. Which ones
+    are pre-rendered can be changed through `combinations`
+    """
+    calculate_all_input_fingerprints = prerender.calculate_input_fingerprints
+    combinations = list(calculate_all_input_fingerprints())[:NUMBER_OF_SIMULATIONS]
+
+    def calculate_input_fingerprints():
+        fingerprints = calculate_all_input_fingerprints()
+        return {combination: fingerprints[combination] for combination in combinations}
+
+    monkeypatch.setattr(
+        prerender,
+        'calculate_input_fingerprints',
+        calculate_input_fingerprints,
+    )
+    return combinations
+
+
+def _prerender(output_directory, capsys) -> int:
+    """
+    Runs the pre-render job and returns the number of simulations it rendered
+    """
+    manifest = prerender_simulations(output_directory=output_directory, workers=1)
+    number_rendered, number_total = RENDERING_PATTERN.search(
+        capsys.readouterr().out,
+    ).groups()
+    assert int(number_total) == len(manifest['simulations'])
+    return int(number_rendered)
+
+
+def test_only_changed_simulations_are_rendered(tmp_path, capsys, simulations):
+    assert _prerender(tmp_path, capsys) == NUMBER_OF_SIMULATIONS
+    assert _prerender(tmp_path, capsys) == 0
+
+    manifest = json.loads((tmp_path / MANIFEST_FILE).read_text())
+    for entry in manifest['simulations'].values():
+        figure = json.loads(gzip.decompress((tmp_path / entry['json']).read_bytes()))
+        assert figure['data']
+
+
+def test_version_bump_renders_every_simulation(
+    tmp_path,
+    capsys,
+    simulations,
+    monkeypatch,
+):
+    _prerender(tmp_path, capsys)
+    monkeypatch.setattr(
+        prerender,
+        'PRERENDER_VERSION',
+        prerender.PRERENDER_VERSION + 1,
+    )
+
+    assert _prerender(tmp_path, capsys) == NUMBER_OF_SIMULATIONS
+    manifest = json.loads((tmp_path / MANIFEST_FILE).read_text())
+    assert manifest['version'] == prerender.PRERENDER_VERSION
+
+
+def test_unreferenced_artifacts_are_removed(tmp_path, capsys, simulations):
+    _prerender(tmp_path, capsys)
+    removed_race, removed_season = simulations.pop()
+
+    assert _prerender(tmp_path, capsys) == 0
+    artifact_files = {path.name for path in tmp_path.glob('*.json.gz')}
+    assert len(artifact_files) == len(simulations)
+    assert not any(
+        file.startswith(f'{removed_race.name}_{removed_season}')
+        for file in artifact_files
+    )
+
+
+@pytest.fixture
+def prerendered_client(tmp_path, capsys, simulations, monkeypatch):
+    """
+    A client of the app, which serves the simulations pre-rendered to `tmp_path`
+    """
+    _prerender(tmp_path, capsys)
+    monkeypatch.setattr(
+        api,
+        'get_prerendered_simulation_path',
+        partial(prerender.get_prerendered_simulation_path, output_directory=tmp_path),
+    )
+    monkeypatch.setitem(app.config, 'SECRET_KEY', 'test')
+    monkeypatch.setitem(app.config, 'WTF_CSRF_ENABLED', False)
+    return app.test_client()
+
+
+def test_prerendered_simulation_page_loads_figure(prerendered_client, simulations):
+    race, season = simulations[0]
+    response = prerendered_client.post(
+        '/simulation',
+        data={'race': race.value, 'year': str(season)},
+    )
+
+    assert response.status_code == 200
+    figure_url = f'/simulation/figure/{season}/{race.name}'
+    assert figure_url in response.get_data(as_text=True)
+
+
+@pytest.mark.parametrize('accept_encoding', ['gzip', 'identity'])
+def test_figure_is_served_gzipped_or_plain(
+    prerendered_client,
+    simulations,
+    accept_encoding,
+):
+    race, season = simulations[0]
+    response = prerendered_client.get(
+        f'/simulation/figure/{season}/{race.name}',
+        headers={'Accept-Encoding': accept_encoding},
+    )
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/json'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    if accept_encoding == 'gzip':
+        assert response.headers['Content-Encoding'] == 'gzip'
+        data = gzip.decompress(response.data)
+    else:
+        assert 'Content-Encoding' not in response.headers
+        data = response.data
+    assert json.loads(data)['data']
+
+
+def test_unknown_or_missing_figure_is_not_found(
+    prerendered_client,
+    simulations,
+    tmp_path,
+):
+    race, season = simulations[0]
+    for url in (
+        f'/simulation/figure/{season}/atlantis',
+        f'/simulation/figure/{SEASON_WITHOUT_DATA}/{race.name}',
+    ):
+        assert prerendered_client.get(url).status_code == 404
+
+    for path in tmp_path.glob('*.json.gz'):
+        path.unlink()
+    response = prerendered_client.get(f'/simulation/figure/{season}/{race.name}')
+    assert response.status_code == 404
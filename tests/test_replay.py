@@ -0,0 +1,53 @@
+import gzip
+import io
+
+import numpy as np
+import pytest
+
+from app.api import app
+from app.load_test import SYNTHETIC_SEASONS
+
+SEASON = SYNTHETIC_SEASONS[-1]
+SEASON_WITHOUT_DATA = SYNTHETIC_SEASONS[0] - 1
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+def test_replay_is_gzipped_npz_with_cache_headers(client):
+    response = client.get(
+        f'/api/race/{SEASON}/australia',
+        headers={'Accept-Encoding': 'gzip'},
+    )
+
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['ETag']
+    assert 'public' in response.headers['Cache-Control']
+    replay = np.load(io.BytesIO(gzip.decompress(response.data)))
+    assert replay['positions'].shape == replay['gaps'].shape
+    assert replay['positions'].shape == (len(replay['laps']), len(replay['drivers']))
+
+
+def test_replay_is_revalidated_with_its_etag(client):
+    response = client.get(f'/api/race/{SEASON}/Australian Grand Prix')
+    revalidated_response = client.get(
+        f'/api/race/{SEASON}/Australian Grand Prix',
+        headers={'If-None-Match': response.headers['ETag']},
+    )
+
+    assert revalidated_response.status_code == 304
+    assert revalidated_response.data == b''
+
+
+@pytest.mark.parametrize('race', ['monaco', 'australia'])
+def test_conditional_request_for_missing_replay_is_not_found(client, race):
+    etag = client.get(f'/api/race/{SEASON}/australia').headers['ETag']
+    response = client.get(
+        f'/api/race/{SEASON_WITHOUT_DATA}/{race}',
+        headers={'If-None-Match': etag.replace(str(SEASON), str(SEASON_WITHOUT_DATA))},
+    )
+
+    assert response.status_code == 404